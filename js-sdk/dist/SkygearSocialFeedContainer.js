@@ -93,36 +93,102 @@ function SkygearSocialFeedContainer() {
       ]);
     };
 
-  this.queryMyFriendsRecords = function queryMyFriendsRecords(query) {
+  this.queryMyFriendsRecords =
+    function queryMyFriendsRecords(query, after, limit) {
+      const Cls = query.recordCls;
+      const serializedQuery = query.toJSON();
+      return skygear.lambda('social_feed:query_my_friends_records', [
+        serializedQuery,
+        after,
+        limit
+      ]).then(function (response) {
+        const records = response.result.map(function (attrs) {
+          return new Cls(attrs);
+        });
+        const result = QueryResult.createFromResult(records);
+        result.cursor = response.cursor;
+        return Promise.resolve(result);
+      }, function (error) {
+        return Promise.reject(error);
+      });
+    };
+
+  this.queryMyFolloweesRecords =
+    function queryMyFolloweesRecords(query, after, limit) {
+      const Cls = query.recordCls;
+      const serializedQuery = query.toJSON();
+      return skygear.lambda('social_feed:query_my_followees_records', [
+        serializedQuery,
+        after,
+        limit
+      ]).then(function (response) {
+        const records = response.result.map(function (attrs) {
+          return new Cls(attrs);
+        });
+        const result = QueryResult.createFromResult(records);
+        result.cursor = response.cursor;
+        return Promise.resolve(result);
+      }, function (error) {
+        return Promise.reject(error);
+      });
+    };
+
+  this.queryMyHomeRecords = function queryMyHomeRecords(query, after, limit) {
     const Cls = query.recordCls;
     const serializedQuery = query.toJSON();
-    return skygear.lambda('social_feed:query_my_friends_records', [
-      serializedQuery
+    return skygear.lambda('social_feed:query_my_home_records', [
+      serializedQuery,
+      after,
+      limit
     ]).then(function (response) {
       const records = response.result.map(function (attrs) {
         return new Cls(attrs);
       });
       const result = QueryResult.createFromResult(records);
+      result.cursor = response.cursor;
       return Promise.resolve(result);
     }, function (error) {
       return Promise.reject(error);
     });
   };
 
-  this.queryMyFolloweesRecords = function queryMyFolloweesRecords(query) {
-    const Cls = query.recordCls;
-    const serializedQuery = query.toJSON();
-    return skygear.lambda('social_feed:query_my_followees_records', [
-      serializedQuery
+  function queryTimeline(lambdaName, after, limit) {
+    const recordClasses = {};
+    return skygear.lambda(lambdaName, [
+      after,
+      limit
     ]).then(function (response) {
       const records = response.result.map(function (attrs) {
+        const recordType = attrs._id.split('/')[0];
+        if (!recordClasses[recordType]) {
+          recordClasses[recordType] = skygear.Record.extend(recordType);
+        }
+        const Cls = recordClasses[recordType];
         return new Cls(attrs);
       });
       const result = QueryResult.createFromResult(records);
+      result.cursor = response.cursor;
       return Promise.resolve(result);
     }, function (error) {
       return Promise.reject(error);
     });
+  }
+
+  this.queryMyFriendsTimeline = function queryMyFriendsTimeline(after, limit) {
+    return queryTimeline('social_feed:query_my_friends_timeline', after, limit);
+  };
+
+  this.queryMyFolloweesTimeline =
+    function queryMyFolloweesTimeline(after, limit) {
+      return queryTimeline(
+        'social_feed:query_my_followees_timeline',
+        after,
+        limit
+      );
+    };
+
+  this.queryMyHomeTimeline = function queryMyHomeTimeline(after, limit) {
+    return queryTimeline('social_feed:query_my_home_timeline', after, limit);
   };
 
   this.reindexSocialFeedIndexForFriends =
@@ -135,6 +201,15 @@ function SkygearSocialFeedContainer() {
       return skygear.lambda('social_feed:reindex_for_followees');
     };
 
+  this.getReindexStatusForFriends = function getReindexStatusForFriends() {
+    return skygear.lambda('social_feed:get_reindex_status', ['friends']);
+  };
+
+  this.getReindexStatusForFollowings =
+    function getReindexStatusForFollowings() {
+      return skygear.lambda('social_feed:get_reindex_status', ['following']);
+    };
+
   this.enableFanoutToFriends = function enableFanoutToFriends() {
     return this.setEnableFanoutToFriends(true);
   };
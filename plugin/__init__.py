@@ -3,19 +3,56 @@ import os
 from skygear import (
     op,
 )
-from skygear.container import SkygearContainer
 from skygear.options import options
 from skygear.utils import db
 from .audit import (
+    register_update_index_for_users_fanout_policy_task,
     register_update_index_if_fanout_policy_change,
+    start_fanout_policy_listener,
+)
+from .cache import (
+    register_get_cache_stats,
+)
+from .container import (
+    get_container,
+    register_get_container_pool_stats,
+)
+from .database import (
+    autocommit_conn,
+)
+from .migration import (
+    create_schema_version_table,
+    migrate_plugin,
+    migrate_record,
+    migrate_relation_index,
+)
+from .orphan import (
+    register_collect_orphan_index,
+)
+from .partition import (
+    register_maintain_relation_index_partitions,
 )
 from .record import (
+    register_fanout_records_task,
     register_query_my_friends_records,
+    register_query_my_friends_timeline,
     register_query_my_followees_records,
-    register_after_save_add_record_to_index_for_friends,
-    register_after_save_add_record_to_index_for_followers,
+    register_query_my_followees_timeline,
+    register_query_my_home_records,
+    register_query_my_home_timeline,
+    register_after_save_add_record_to_index,
+    register_after_delete_remove_record_from_index,
+    register_remove_records_from_index_task,
+)
+from .reindex import (
+    register_get_reindex_status,
+    register_process_reindex_jobs,
 )
 from .relation import (
+    register_create_index_for_friends_task,
+    register_create_index_for_followees_task,
+    register_remove_index_for_friends_task,
+    register_remove_index_for_followees_task,
     register_create_index_for_friends,
     register_create_index_for_followee,
     register_remove_index_for_friends,
@@ -24,13 +61,23 @@ from .relation import (
     register_reindex_for_followees,
 )
 from .table_name import (
+    is_compact_index_storage,
     name_for_followings_relation_index,
-    name_for_friends_relation_index
+    name_for_friends_relation_index,
+    name_for_relation_index,
+)
+from .trim import (
+    register_trim_over_length_feeds,
 )
 from .user import (
     register_set_enable_fanout_to_relation,
     register_get_user_fanout_policy,
 )
+from .work_queue import (
+    register_get_work_queue_stats,
+    register_retry_dead_tasks,
+    start_work_queue_workers,
+)
 
 SKYGEAR_APP_NAME = os.getenv('APP_NAME', 'my_skygear_app')
 SOCIAL_FEED_TABLE_PREFIX = 'skygear_social_feed'
@@ -62,6 +109,10 @@ def create_table_for_social_feed(container, record_type):
                             'name': 'record_ref',
                             'type': 'ref({0})'.format(record_type),
                         },
+                        {
+                            'name': 'record_created_at',
+                            'type': 'datetime',
+                        },
                     ]
                 }
             }
@@ -90,6 +141,10 @@ def create_table_for_social_feed(container, record_type):
                             'name': 'record_ref',
                             'type': 'ref({0})'.format(record_type),
                         },
+                        {
+                            'name': 'record_created_at',
+                            'type': 'datetime',
+                        },
                     ]
                 }
             }
@@ -99,7 +154,7 @@ def create_table_for_social_feed(container, record_type):
 
 @op('social-feed-init')
 def social_feed_init():
-    container = SkygearContainer(api_key=options.masterkey)
+    container = get_container(options.masterkey)
 
     container.send_action(
         'schema:create',
@@ -125,17 +180,34 @@ def social_feed_init():
         }
     )
 
-    for record_type in SOCIAL_FEED_RECORD_TYPES:
-        create_table_for_social_feed(container, record_type)
+    if not is_compact_index_storage():
+        for record_type in SOCIAL_FEED_RECORD_TYPES:
+            create_table_for_social_feed(container, record_type)
 
     with db.conn() as conn:
         sql = 'CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'
         conn.execute(sql)
 
+    with autocommit_conn() as conn:
+        create_schema_version_table(conn)
+        migrate_plugin(conn)
+        for record_type in SOCIAL_FEED_RECORD_TYPES:
+            migrate_record(conn, record_type)
+            for relation in ['friends', 'following']:
+                migrate_relation_index(
+                    conn,
+                    table_name=name_for_relation_index(
+                        prefix=SOCIAL_FEED_TABLE_PREFIX,
+                        relation=relation,
+                        record_type=record_type
+                    ),
+                    record_type=record_type
+                )
+
 
 for record_type in SOCIAL_FEED_RECORD_TYPES:
-    register_after_save_add_record_to_index_for_friends(record_type)
-    register_after_save_add_record_to_index_for_followers(record_type)
+    register_after_save_add_record_to_index(record_type)
+    register_after_delete_remove_record_from_index(record_type)
 
 register_create_index_for_friends()
 register_create_index_for_followee()
@@ -143,13 +215,40 @@ register_create_index_for_followee()
 register_query_my_friends_records()
 register_query_my_followees_records()
 
+register_query_my_friends_timeline()
+register_query_my_followees_timeline()
+
+register_query_my_home_records()
+register_query_my_home_timeline()
+
 register_remove_index_for_friends()
 register_remove_index_for_followees()
 
 register_reindex_for_friends()
 register_reindex_for_followees()
+register_get_reindex_status()
+register_process_reindex_jobs()
 
 register_set_enable_fanout_to_relation()
 register_get_user_fanout_policy()
 
+register_get_cache_stats()
+register_get_container_pool_stats()
+
 register_update_index_if_fanout_policy_change()
+
+register_maintain_relation_index_partitions()
+register_trim_over_length_feeds()
+register_collect_orphan_index()
+
+register_fanout_records_task()
+register_remove_records_from_index_task()
+register_create_index_for_friends_task()
+register_create_index_for_followees_task()
+register_remove_index_for_friends_task()
+register_remove_index_for_followees_task()
+register_update_index_for_users_fanout_policy_task()
+register_get_work_queue_stats()
+register_retry_dead_tasks()
+start_work_queue_workers()
+start_fanout_policy_listener()
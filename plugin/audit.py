@@ -1,4 +1,9 @@
 import json
+import logging
+import random
+import select
+import threading
+import time
 
 from skygear import (
     every,
@@ -6,24 +11,63 @@ from skygear import (
 from skygear.utils import db
 import sqlalchemy as sa
 
+from .backfill import (
+    sql_for_backfill_insert,
+)
+from .database import (
+    autocommit_conn,
+)
+from .feed import (
+    sql_for_pull_fanout_user_exclusion,
+    sql_for_relation_index_id,
+)
 from .options import (
     DB_NAME,
+    SOCIAL_FEED_AUDIT_BATCH_SIZE,
+    SOCIAL_FEED_AUDIT_SHARDS,
     SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
+    SOCIAL_FEED_FANOUT_POLICY_NOTIFY_ENABLED,
     SOCIAL_FEED_RECORD_TYPES,
     SOCIAL_FEED_TABLE_PREFIX,
 )
+from .page_cache import (
+    sql_for_versioned_index_change,
+)
 from .relation import (
     DIRECTION_MUTUAL,
     DIRECTION_OUTWARD,
     RELATION_TABLE_MAP,
 )
 from .table_name import (
+    name_for_mutual_friend_table,
     name_for_relation_index,
 )
+from .user import (
+    FANOUT_POLICY_CHANGE_CHANNEL,
+    fanout_policy_cache,
+)
+from .work_queue import (
+    enqueue_task,
+    is_work_queue_enabled,
+    task,
+)
+
+logger = logging.getLogger(__name__)
+
+AUDIT_LOCK_NAME = 'social_feed:update_index_if_fanout_policy_change'
+LISTEN_POLL_TIMEOUT = 60
+LISTEN_RECONNECT_DELAY = 5
+
+_listeners = []
+
+
+def is_fanout_policy_notify_enabled():
+    return SOCIAL_FEED_FANOUT_POLICY_NOTIFY_ENABLED
 
 
 def remove_relation_index_if_fanout_policy_change_to_false(conn, relation,
-                                                           record_type):
+                                                           record_type,
+                                                           user_ids):
     table_name = name_for_relation_index(
         prefix=SOCIAL_FEED_TABLE_PREFIX,
         relation=relation,
@@ -32,12 +76,12 @@ def remove_relation_index_if_fanout_policy_change_to_false(conn, relation,
     relation_fanout_policy = {
         relation: False
     }
-    remove_feed_index_sql = sa.text('''
+    remove_feed_index_sql = sa.text(sql_for_versioned_index_change('''
         DELETE FROM {db_name}.{table_name} feed_table
         WHERE feed_table.right_id IN (
-            SELECT _id
+            SELECT {user_id}
             FROM {db_name}.user
-            WHERE social_feed_fanout_policy_is_dirty IS TRUE
+            WHERE _id IN :user_ids
             AND COALESCE(
                 social_feed_fanout_policy,
                 '{default_fanout_policy}' ::jsonb
@@ -46,91 +90,65 @@ def remove_relation_index_if_fanout_policy_change_to_false(conn, relation,
     '''.format(
         db_name=DB_NAME,
         table_name=table_name,
+        user_id=sql_for_relation_index_id('_id'),
         default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
         relation_fanout_policy=json.dumps(relation_fanout_policy)
-    ))
-    conn.execute(remove_feed_index_sql)
+    )))
+    conn.execute(remove_feed_index_sql, user_ids=tuple(user_ids))
 
 
 def reindex_mutual_relation_index_if_fanout_policy_change_to_true(conn,
                                                                   relation,
-                                                                  record_type):
+                                                                  record_type,
+                                                                  user_ids):
     table_name = name_for_relation_index(
         prefix=SOCIAL_FEED_TABLE_PREFIX,
         relation=relation,
         record_type=record_type
     )
-    relation_table = RELATION_TABLE_MAP[relation]
     relation_fanout_policy = {
         relation: True
     }
-    reindex_feed_sql = sa.text('''
-        INSERT INTO {db_name}.{table_name} (
-            _id,
-            _database_id,
-            _owner_id,
-            _created_at,
-            _created_by,
-            _updated_at,
-            _updated_by,
-            _access,
-            left_id,
-            right_id,
-            record_ref
-        )
+    new_index_sql = '''
         SELECT
-            uuid_generate_v4()::text as _id,
-            '' as _database_id,
-            t.left_id as _owner_id,
-            current_timestamp as _created_at,
-            t.left_id as created_by,
-            current_timestamp as _updated_at,
-            t.left_id as _updated_by,
-            '[]'::jsonb as _access,
-            t.left_id as left_id,
-            t.right_id as right_id,
-            t.record_ref as record_ref
-        FROM (
-            SELECT
-                f1.left_id as left_id,
-                f1.right_id as right_id,
-                record_table._id as record_ref
-            FROM {db_name}.{relation_table} f1
-            JOIN {db_name}.user user_table
-            ON (
-                user_table._id = f1.right_id
-                AND user_table.social_feed_fanout_policy_is_dirty = TRUE
-                AND COALESCE(
-                    social_feed_fanout_policy,
-                    '{default_fanout_policy}'::jsonb
-                ) @> '{relation_fanout_policy}'::jsonb
-            )
-            JOIN {db_name}.{relation_table} f2
-            ON f1.left_id = f2.right_id AND f1.right_id = f2.left_id
-            JOIN {db_name}.{record_type} record_table
-            ON record_table._owner_id = f1.right_id
-            EXCEPT
-            SELECT
-                left_id,
-                right_id,
-                record_ref
-            FROM {db_name}.{table_name}
-        ) AS t
+            m.right_id as left_id,
+            m.left_id as right_id,
+            record_table._id as record_ref,
+            record_table._created_at as record_created_at
+        FROM {db_name}.{mutual_friend_table} m
+        JOIN {db_name}.user user_table
+        ON (
+            user_table._id = m.left_id
+            AND user_table._id IN :user_ids
+            AND COALESCE(
+                social_feed_fanout_policy,
+                '{default_fanout_policy}'::jsonb
+            ) @> '{relation_fanout_policy}'::jsonb
+        )
+        JOIN {db_name}.{record_type} record_table
+        ON record_table._owner_id = m.left_id
     '''.format(
         db_name=DB_NAME,
-        table_name=table_name,
-        relation_table=relation_table,
+        mutual_friend_table=name_for_mutual_friend_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
         record_type=record_type,
         default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
         relation_fanout_policy=json.dumps(relation_fanout_policy)
+    )
+    reindex_feed_sql = sa.text(sql_for_backfill_insert(
+        table_name,
+        new_index_sql,
+        bump_versions=True
     ))
-    conn.execute(reindex_feed_sql)
+    conn.execute(reindex_feed_sql, user_ids=tuple(user_ids))
 
 
 def reindex_outward_relation_index_if_fanout_policy_change_to_true(
         conn,
         relation,
-        record_type):
+        record_type,
+        user_ids):
     table_name = name_for_relation_index(
         prefix=SOCIAL_FEED_TABLE_PREFIX,
         relation=relation,
@@ -140,118 +158,253 @@ def reindex_outward_relation_index_if_fanout_policy_change_to_true(
     relation_fanout_policy = {
         relation: True
     }
-    reindex_feed_sql = sa.text('''
-        INSERT INTO {db_name}.{table_name} (
-            _id,
-            _database_id,
-            _owner_id,
-            _created_at,
-            _created_by,
-            _updated_at,
-            _updated_by,
-            _access,
-            left_id,
-            right_id,
-            record_ref
+    pull_fanout_user_exclusion = ''
+    if relation == 'following':
+        pull_fanout_user_exclusion = sql_for_pull_fanout_user_exclusion(
+            'f1.right_id'
         )
+    new_index_sql = '''
         SELECT
-            uuid_generate_v4()::text as _id,
-            '' as _database_id,
-            t.left_id as _owner_id,
-            current_timestamp as _created_at,
-            t.left_id as created_by,
-            current_timestamp as _updated_at,
-            t.left_id as _updated_by,
-            '[]'::jsonb as _access,
-            t.left_id as left_id,
-            t.right_id as right_id,
-            t.record_ref as record_ref
-        FROM (
-            SELECT
-                f1.left_id as left_id,
-                f1.right_id as right_id,
-                record_table._id as record_ref
-            FROM {db_name}.{relation_table} f1
-            JOIN {db_name}.user user_table
-            ON (
-                user_table._id = f1.right_id
-                AND user_table.social_feed_fanout_policy_is_dirty = TRUE
-                AND COALESCE(
-                    social_feed_fanout_policy,
-                    '{default_fanout_policy}'::jsonb
-                ) @> '{relation_fanout_policy}'::jsonb
-            )
-            JOIN {db_name}.{record_type} record_table
-            ON record_table._owner_id = f1.right_id
-            EXCEPT
-            SELECT
-                left_id,
-                right_id,
-                record_ref
-            FROM {db_name}.{table_name}
-        ) AS t
+            f1.left_id as left_id,
+            f1.right_id as right_id,
+            record_table._id as record_ref,
+            record_table._created_at as record_created_at
+        FROM {db_name}.{relation_table} f1
+        JOIN {db_name}.user user_table
+        ON (
+            user_table._id = f1.right_id
+            AND user_table._id IN :user_ids
+            AND COALESCE(
+                social_feed_fanout_policy,
+                '{default_fanout_policy}'::jsonb
+            ) @> '{relation_fanout_policy}'::jsonb
+        )
+        JOIN {db_name}.{record_type} record_table
+        ON record_table._owner_id = f1.right_id
+        WHERE TRUE
+        {pull_fanout_user_exclusion}
     '''.format(
         db_name=DB_NAME,
-        table_name=table_name,
         relation_table=relation_table,
         record_type=record_type,
         default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
-        relation_fanout_policy=json.dumps(relation_fanout_policy)
+        relation_fanout_policy=json.dumps(relation_fanout_policy),
+        pull_fanout_user_exclusion=pull_fanout_user_exclusion
+    )
+    reindex_feed_sql = sa.text(sql_for_backfill_insert(
+        table_name,
+        new_index_sql,
+        bump_versions=True
     ))
-    conn.execute(reindex_feed_sql)
+    conn.execute(reindex_feed_sql, user_ids=tuple(user_ids))
 
 
 def reindex_relation_index_if_fanout_policy_change_to_true(conn, relation,
                                                            relation_direction,
-                                                           record_type):
+                                                           record_type,
+                                                           user_ids):
     if relation_direction == DIRECTION_MUTUAL:
         reindex_mutual_relation_index_if_fanout_policy_change_to_true(
             conn=conn,
             relation=relation,
-            record_type=record_type
+            record_type=record_type,
+            user_ids=user_ids
         )
     elif relation_direction == DIRECTION_OUTWARD:
         reindex_outward_relation_index_if_fanout_policy_change_to_true(
             conn=conn,
             relation=relation,
             record_type=record_type,
+            user_ids=user_ids
         )
 
 
-def reset_social_feed_fanout_policy_is_dirty_flag(conn):
+def try_lock_audit_shard(conn, shard):
+    try_lock_audit_shard_sql = sa.text('''
+        SELECT pg_try_advisory_xact_lock(hashtext(:lock_name), :shard)
+    ''')
+    return conn.execute(
+        try_lock_audit_shard_sql,
+        lock_name=AUDIT_LOCK_NAME,
+        shard=shard
+    ).scalar()
+
+
+def lock_social_feed_fanout_policy_dirty_users(conn, shard, limit):
+    lock_dirty_users_sql = sa.text('''
+        SELECT _id as id
+        FROM {db_name}.user
+        WHERE social_feed_fanout_policy_is_dirty IS TRUE
+        AND (hashtext(_id) & 2147483647) % :shards = :shard
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    '''.format(db_name=DB_NAME))
+    results = conn.execute(
+        lock_dirty_users_sql,
+        shards=SOCIAL_FEED_AUDIT_SHARDS,
+        shard=shard,
+        limit=limit
+    )
+    return [user.id for user in results]
+
+
+def lock_social_feed_fanout_policy_dirty_users_by_ids(conn, user_ids):
+    lock_dirty_users_sql = sa.text('''
+        SELECT _id as id
+        FROM {db_name}.user
+        WHERE social_feed_fanout_policy_is_dirty IS TRUE
+        AND _id IN :user_ids
+        FOR UPDATE SKIP LOCKED
+    '''.format(db_name=DB_NAME))
+    results = conn.execute(lock_dirty_users_sql, user_ids=tuple(user_ids))
+    return [user.id for user in results]
+
+
+def reset_social_feed_fanout_policy_is_dirty_flag(conn, user_ids):
     reset_flag_sql = sa.text('''
         UPDATE {db_name}.user
         SET social_feed_fanout_policy_is_dirty = FALSE
-        WHERE social_feed_fanout_policy_is_dirty = TRUE
+        WHERE _id IN :user_ids
     '''.format(db_name=DB_NAME))
-    conn.execute(reset_flag_sql)
+    conn.execute(reset_flag_sql, user_ids=tuple(user_ids))
+
+
+def update_index_for_users_fanout_policy(conn, user_ids):
+    for record_type in SOCIAL_FEED_RECORD_TYPES:
+        remove_relation_index_if_fanout_policy_change_to_false(
+            conn=conn,
+            relation='friends',
+            record_type=record_type,
+            user_ids=user_ids
+        )
+        remove_relation_index_if_fanout_policy_change_to_false(
+            conn=conn,
+            relation='following',
+            record_type=record_type,
+            user_ids=user_ids
+        )
+        reindex_relation_index_if_fanout_policy_change_to_true(
+            conn=conn,
+            relation='friends',
+            relation_direction=DIRECTION_MUTUAL,
+            record_type=record_type,
+            user_ids=user_ids
+        )
+        reindex_relation_index_if_fanout_policy_change_to_true(
+            conn=conn,
+            relation='following',
+            relation_direction=DIRECTION_OUTWARD,
+            record_type=record_type,
+            user_ids=user_ids
+        )
+
+
+def update_index_for_dirty_users(conn, user_ids):
+    if is_work_queue_enabled():
+        enqueue_task(
+            conn,
+            'social_feed:update_index_for_users_fanout_policy',
+            {'user_ids': user_ids}
+        )
+    else:
+        update_index_for_users_fanout_policy(conn, user_ids)
+    reset_social_feed_fanout_policy_is_dirty_flag(conn, user_ids)
+
+
+def update_index_for_dirty_fanout_policy_batch(shard):
+    with db.conn() as conn:
+        if not try_lock_audit_shard(conn, shard):
+            return 0
+
+        user_ids = lock_social_feed_fanout_policy_dirty_users(
+            conn,
+            shard=shard,
+            limit=SOCIAL_FEED_AUDIT_BATCH_SIZE
+        )
+        if not user_ids:
+            return 0
+
+        update_index_for_dirty_users(conn, user_ids)
+    return len(user_ids)
+
+
+def update_index_for_notified_users(user_ids):
+    with db.conn() as conn:
+        # Every instance receives the notification, only the one locking the
+        # dirty users first reconciles them.
+        dirty_user_ids = lock_social_feed_fanout_policy_dirty_users_by_ids(
+            conn,
+            user_ids
+        )
+        if dirty_user_ids:
+            update_index_for_dirty_users(conn, dirty_user_ids)
+
+
+def listen_fanout_policy_change():
+    with autocommit_conn() as conn:
+        conn.execute('LISTEN "{channel}"'.format(
+            channel=FANOUT_POLICY_CHANGE_CHANNEL
+        ))
+        dbapi_conn = conn.connection.connection
+        while True:
+            readable, _, _ = select.select(
+                [dbapi_conn], [], [], LISTEN_POLL_TIMEOUT
+            )
+            if not readable:
+                continue
+
+            dbapi_conn.poll()
+            notified_user_ids = set()
+            while dbapi_conn.notifies:
+                notified_user_ids.add(dbapi_conn.notifies.pop(0).payload)
+            # Every instance evicts its own cached policies, also when another
+            # instance wins the reconcile below.
+            for user_id in notified_user_ids:
+                fanout_policy_cache.delete(user_id)
+            user_ids = sorted(notified_user_ids)
+            for i in range(0, len(user_ids), SOCIAL_FEED_AUDIT_BATCH_SIZE):
+                update_index_for_notified_users(
+                    user_ids[i:i + SOCIAL_FEED_AUDIT_BATCH_SIZE]
+                )
+
+
+def run_fanout_policy_listener():
+    while True:
+        try:
+            listen_fanout_policy_change()
+        except Exception:
+            logger.exception('Failed to listen for fanout policy change')
+        time.sleep(LISTEN_RECONNECT_DELAY)
+
+
+def start_fanout_policy_listener():
+    if not is_fanout_policy_notify_enabled() or _listeners:
+        return
+
+    listener = threading.Thread(target=run_fanout_policy_listener)
+    listener.daemon = True
+    listener.start()
+    _listeners.append(listener)
+
+
+def register_update_index_for_users_fanout_policy_task():
+    @task('social_feed:update_index_for_users_fanout_policy')
+    def update_index_for_users_fanout_policy_task(conn, payload):
+        update_index_for_users_fanout_policy(conn, payload['user_ids'])
 
 
 def register_update_index_if_fanout_policy_change():
-    @every("@every 15m")
+    # With notifications on, the job only sweeps up changes a listener missed.
+    audit_interval = "@every 15m"
+    if is_fanout_policy_notify_enabled():
+        audit_interval = "@every 1h"
+
+    @every(audit_interval)
     def update_index_if_fanout_policy_change():
-        with db.conn() as conn:
-            for record_type in SOCIAL_FEED_RECORD_TYPES:
-                remove_relation_index_if_fanout_policy_change_to_false(
-                    conn=conn,
-                    relation='friends',
-                    record_type=record_type
-                )
-                remove_relation_index_if_fanout_policy_change_to_false(
-                    conn=conn,
-                    relation='following',
-                    record_type=record_type
-                )
-                reindex_relation_index_if_fanout_policy_change_to_true(
-                    conn=conn,
-                    relation='friends',
-                    relation_direction=DIRECTION_MUTUAL,
-                    record_type=record_type
-                )
-                reindex_relation_index_if_fanout_policy_change_to_true(
-                    conn=conn,
-                    relation='following',
-                    relation_direction=DIRECTION_OUTWARD,
-                    record_type=record_type
-                )
-            reset_social_feed_fanout_policy_is_dirty_flag(conn)
+        # Start from a random shard so instances ticking together spread
+        # over different shards instead of racing for the first one.
+        first_shard = random.randrange(SOCIAL_FEED_AUDIT_SHARDS)
+        for i in range(SOCIAL_FEED_AUDIT_SHARDS):
+            shard = (first_shard + i) % SOCIAL_FEED_AUDIT_SHARDS
+            while update_index_for_dirty_fanout_policy_batch(shard) > 0:
+                pass
@@ -0,0 +1,395 @@
+import sqlalchemy as sa
+
+from .feed import (
+    sql_for_pull_fanout_user_exclusion,
+    sql_for_relation_index_insert,
+    sql_for_relation_index_value,
+)
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_BACKFILL_BATCH_SIZE,
+    SOCIAL_FEED_BACKFILL_DAYS,
+    SOCIAL_FEED_BACKFILL_RECORDS,
+    SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+from .page_cache import (
+    bump_feed_versions,
+    is_feed_page_cache_enabled,
+    sql_for_feed_version_bump,
+)
+from .table_name import (
+    name_for_backfill_watermark_table,
+    name_for_mutual_friend_table,
+    name_for_relation_index,
+)
+from .trim import (
+    is_feed_length_cap_enabled,
+    sql_for_feed_length_increment,
+)
+
+
+def is_backfill_window_enabled():
+    return SOCIAL_FEED_BACKFILL_RECORDS > 0 or SOCIAL_FEED_BACKFILL_DAYS > 0
+
+
+def sql_for_backfill_window_condition():
+    conditions = ['TRUE']
+    if SOCIAL_FEED_BACKFILL_RECORDS > 0:
+        conditions.append('backfill_rank <= {0:d}'.format(
+            SOCIAL_FEED_BACKFILL_RECORDS
+        ))
+    if SOCIAL_FEED_BACKFILL_DAYS > 0:
+        conditions.append('''
+            record_created_at >= (
+                timezone('UTC', now()) - interval '{0:d} days'
+            )
+        '''.format(SOCIAL_FEED_BACKFILL_DAYS))
+    return ' AND '.join(conditions)
+
+
+def sql_for_index_insert_statement(table_name, index_ctes, new_index_sql,
+                                   bump_versions=False):
+    followup_sqls = []
+    if is_feed_length_cap_enabled():
+        followup_sqls.append(sql_for_feed_length_increment([
+            (table_name, 'new_index_entry'),
+        ]))
+    if bump_versions and is_feed_page_cache_enabled():
+        followup_sqls.append(sql_for_feed_version_bump(
+            'SELECT left_id FROM new_index_entry'
+        ))
+
+    returning_sql = ''
+    if followup_sqls:
+        returning_sql = 'RETURNING {0} as left_id'.format(
+            sql_for_relation_index_value('left_id')
+        )
+    index_insert_sql = sql_for_relation_index_insert(
+        table_name,
+        new_index_sql,
+        returning_sql=returning_sql
+    )
+
+    # Data-modifying statements are only allowed in a top level WITH, so
+    # the insert and its follow-ups are chained as sibling CTEs.
+    ctes = list(index_ctes)
+    if followup_sqls:
+        ctes.append(('new_index_entry', index_insert_sql))
+        ctes.extend(
+            ('index_followup_{0:d}'.format(i), followup_sql)
+            for i, followup_sql in enumerate(followup_sqls[:-1])
+        )
+        index_insert_sql = followup_sqls[-1]
+    if not ctes:
+        return index_insert_sql
+
+    return '''
+        WITH {ctes}
+        {statement_sql}
+    '''.format(
+        ctes=', '.join(
+            '{0} AS ({1})'.format(name, cte_sql) for name, cte_sql in ctes
+        ),
+        statement_sql=index_insert_sql
+    )
+
+
+def sql_for_backfill_insert(table_name, new_index_sql, bump_versions=False):
+    if not is_backfill_window_enabled():
+        return sql_for_index_insert_statement(
+            table_name,
+            [],
+            new_index_sql,
+            bump_versions=bump_versions
+        )
+
+    # Only the newest records of each pair are indexed, the newest record
+    # left out is kept as the pair's watermark for the lazy backfill.
+    backfill_sql = '''
+        SELECT
+            left_id,
+            right_id,
+            record_ref,
+            record_created_at,
+            ({window_condition}) as in_backfill_window
+        FROM (
+            SELECT
+                new_index.*,
+                row_number() OVER (
+                    PARTITION BY new_index.left_id, new_index.right_id
+                    ORDER BY
+                        new_index.record_created_at DESC,
+                        new_index.record_ref DESC
+                ) as backfill_rank
+            FROM ({new_index_sql}) new_index
+        ) ranked_index
+    '''.format(
+        window_condition=sql_for_backfill_window_condition(),
+        new_index_sql=new_index_sql
+    )
+    backfill_watermark_sql = '''
+        INSERT INTO {db_name}.{backfill_watermark_table} AS watermark (
+            table_name,
+            left_id,
+            right_id,
+            unindexed_until
+        )
+        SELECT
+            '{table_name}'::text,
+            left_id,
+            right_id,
+            max(record_created_at)
+        FROM backfill
+        WHERE NOT in_backfill_window
+        GROUP BY left_id, right_id
+        ON CONFLICT (table_name, left_id, right_id) DO UPDATE
+        SET unindexed_until = GREATEST(
+            watermark.unindexed_until,
+            excluded.unindexed_until
+        )
+    '''.format(
+        db_name=DB_NAME,
+        backfill_watermark_table=name_for_backfill_watermark_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        table_name=table_name
+    )
+    return sql_for_index_insert_statement(
+        table_name,
+        [
+            ('backfill', backfill_sql),
+            ('backfill_watermark', backfill_watermark_sql),
+        ],
+        '''
+            SELECT left_id, right_id, record_ref, record_created_at
+            FROM backfill
+            WHERE in_backfill_window
+        ''',
+        bump_versions=bump_versions
+    )
+
+
+def sql_for_watermark_connection_condition(relation):
+    if relation == 'friends':
+        return '''
+            EXISTS (
+                SELECT 1
+                FROM {db_name}.{mutual_friend_table} m
+                WHERE m.left_id = watermark.left_id
+                AND m.right_id = watermark.right_id
+            )
+        '''.format(
+            db_name=DB_NAME,
+            mutual_friend_table=name_for_mutual_friend_table(
+                SOCIAL_FEED_TABLE_PREFIX
+            )
+        )
+
+    return '''
+        EXISTS (
+            SELECT 1
+            FROM {db_name}._follow f
+            WHERE f.left_id = watermark.left_id
+            AND f.right_id = watermark.right_id
+        )
+        {pull_fanout_user_exclusion}
+    '''.format(
+        db_name=DB_NAME,
+        pull_fanout_user_exclusion=sql_for_pull_fanout_user_exclusion(
+            'watermark.right_id'
+        )
+    )
+
+
+def has_backfill_watermark(conn, user_id):
+    has_backfill_watermark_sql = sa.text('''
+        SELECT 1
+        FROM {db_name}.{backfill_watermark_table}
+        WHERE left_id = :user_id
+        LIMIT 1
+    '''.format(
+        db_name=DB_NAME,
+        backfill_watermark_table=name_for_backfill_watermark_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    return conn.execute(
+        has_backfill_watermark_sql,
+        user_id=user_id
+    ).first() is not None
+
+
+def get_backfill_batch_size(limit):
+    # A page cut off at a batch smaller than the page would skip the records
+    # between the batch and the end of the page, so a page reads at least
+    # limit records. Unpaginated queries read every record and are not cut.
+    if SOCIAL_FEED_BACKFILL_BATCH_SIZE <= 0 or limit is None:
+        return 0
+    return max(SOCIAL_FEED_BACKFILL_BATCH_SIZE, limit)
+
+
+def get_backfill_cutoff(conn, table_name, record_type, user_id, before,
+                        batch_size):
+    params = {
+        'table_name': table_name,
+        'user_id': user_id,
+        'batch_size': batch_size,
+    }
+    before_condition = ''
+    if before is not None:
+        params['before'] = before
+        before_condition = '''
+            AND watermark.unindexed_until >= :before
+            AND record_table._created_at >= :before
+        '''
+
+    # The newest unindexed records of a request are capped by moving the
+    # lower bound up to the batch size'th newest one.
+    get_backfill_cutoff_sql = sa.text('''
+        SELECT record_table._created_at
+        FROM {db_name}.{backfill_watermark_table} watermark
+        JOIN {db_name}.{record_type} record_table
+        ON record_table._owner_id = watermark.right_id
+        WHERE watermark.table_name = :table_name
+        AND watermark.left_id = :user_id
+        AND record_table._created_at <= watermark.unindexed_until
+        {before_condition}
+        ORDER BY record_table._created_at DESC
+        OFFSET :batch_size - 1
+        LIMIT 1
+    '''.format(
+        db_name=DB_NAME,
+        backfill_watermark_table=name_for_backfill_watermark_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        record_type=record_type,
+        before_condition=before_condition
+    ))
+    cutoff = conn.execute(get_backfill_cutoff_sql, **params).scalar()
+    if cutoff is None:
+        return before
+    return cutoff
+
+
+def backfill_relation_index(conn, relation, record_type, user_id, before,
+                            batch_size):
+    table_name = name_for_relation_index(
+        prefix=SOCIAL_FEED_TABLE_PREFIX,
+        relation=relation,
+        record_type=record_type
+    )
+    backfill_watermark_table = name_for_backfill_watermark_table(
+        SOCIAL_FEED_TABLE_PREFIX
+    )
+    if batch_size > 0:
+        before = get_backfill_cutoff(
+            conn,
+            table_name,
+            record_type,
+            user_id,
+            before,
+            batch_size
+        )
+    params = {
+        'table_name': table_name,
+        'user_id': user_id,
+    }
+    watermark_condition = ''
+    record_condition = ''
+    next_watermark_sql = 'NULL'
+    if before is not None:
+        params['before'] = before
+        watermark_condition = 'AND watermark.unindexed_until >= :before'
+        record_condition = 'AND record_table._created_at >= :before'
+        next_watermark_sql = '''(
+            SELECT max(record_table._created_at)
+            FROM {db_name}.{record_type} record_table
+            WHERE record_table._owner_id = watermark.right_id
+            AND record_table._created_at < :before
+        )'''.format(db_name=DB_NAME, record_type=record_type)
+
+    new_index_sql = '''
+        SELECT
+            watermark.left_id,
+            watermark.right_id,
+            record_table._id as record_ref,
+            record_table._created_at as record_created_at
+        FROM {db_name}.{backfill_watermark_table} watermark
+        JOIN {db_name}.{record_type} record_table
+        ON record_table._owner_id = watermark.right_id
+        LEFT JOIN {db_name}.user user_table
+        ON user_table._id = watermark.right_id
+        WHERE watermark.table_name = :table_name
+        AND watermark.left_id = :user_id
+        {watermark_condition}
+        AND record_table._created_at <= watermark.unindexed_until
+        {record_condition}
+        AND COALESCE(
+            user_table.social_feed_fanout_policy,
+            '{default_fanout_policy}'::jsonb
+        ) @> '{req_fanout_policy}'::jsonb
+        AND {connection_condition}
+    '''.format(
+        db_name=DB_NAME,
+        backfill_watermark_table=backfill_watermark_table,
+        record_type=record_type,
+        watermark_condition=watermark_condition,
+        record_condition=record_condition,
+        default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
+        req_fanout_policy='{{"{0}": true}}'.format(relation),
+        connection_condition=sql_for_watermark_connection_condition(relation)
+    )
+    backfill_index_sql = sa.text(
+        sql_for_index_insert_statement(table_name, [], new_index_sql)
+    )
+    backfilled = conn.execute(backfill_index_sql, **params).rowcount
+
+    update_watermark_sql = sa.text('''
+        UPDATE {db_name}.{backfill_watermark_table} watermark
+        SET unindexed_until = {next_watermark_sql}
+        WHERE watermark.table_name = :table_name
+        AND watermark.left_id = :user_id
+        {watermark_condition}
+    '''.format(
+        db_name=DB_NAME,
+        backfill_watermark_table=backfill_watermark_table,
+        next_watermark_sql=next_watermark_sql,
+        watermark_condition=watermark_condition
+    ))
+    conn.execute(update_watermark_sql, **params)
+
+    remove_watermark_sql = sa.text('''
+        DELETE FROM {db_name}.{backfill_watermark_table}
+        WHERE table_name = :table_name
+        AND left_id = :user_id
+        AND unindexed_until IS NULL
+    '''.format(
+        db_name=DB_NAME,
+        backfill_watermark_table=backfill_watermark_table
+    ))
+    conn.execute(remove_watermark_sql, **params)
+    return backfilled
+
+
+def backfill_feed(conn, relations, record_types, user_id, before, limit):
+    if not is_backfill_window_enabled():
+        return 0
+    if not has_backfill_watermark(conn, user_id):
+        return 0
+
+    batch_size = get_backfill_batch_size(limit)
+    backfilled = 0
+    for relation in relations:
+        for record_type in record_types:
+            backfilled += backfill_relation_index(
+                conn,
+                relation,
+                record_type,
+                user_id,
+                before,
+                batch_size
+            )
+    if backfilled:
+        bump_feed_versions(conn, [user_id])
+    return backfilled
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+import threading
+import time
+
+from skygear import (
+    op,
+)
+
+MISSING = object()
+
+_caches = OrderedDict()
+
+
+class LRUCache(object):
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _caches[name] = self
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is not MISSING and entry[1] < time.time():
+                del self._entries[key]
+                entry = MISSING
+            if entry is MISSING:
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def register_get_cache_stats():
+    @op('social_feed:get_cache_stats', key_required=True)
+    def get_cache_stats():
+        return {
+            name: cache.stats() for name, cache in _caches.items()
+        }
@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+import requests
+from skygear import (
+    op,
+)
+from skygear.container import (
+    PayloadEncoder,
+    SkygearContainer,
+)
+from skygear.error import (
+    SkygearException,
+)
+
+from .options import (
+    SOCIAL_FEED_CONTAINER_ENDPOINT,
+    SOCIAL_FEED_CONTAINER_POOL_SIZE,
+    SOCIAL_FEED_CONTAINER_POOL_TIMEOUT,
+    SOCIAL_FEED_CONTAINER_REQUEST_TIMEOUT,
+)
+
+_containers = {}
+_containers_lock = threading.Lock()
+_pooled_transport = None
+
+
+class ContainerPoolTimeout(Exception):
+    pass
+
+
+class PooledHttpTransport(object):
+    def __init__(self, pool_size, pool_timeout):
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.request_count = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+
+    def _acquire_slot(self):
+        started_at = time.time()
+        acquired = self._slots.acquire(timeout=self.pool_timeout)
+        wait = time.time() - started_at
+        with self._lock:
+            if not acquired:
+                self.timeouts += 1
+                raise ContainerPoolTimeout(
+                    'No container connection available in {0}s'.format(
+                        self.pool_timeout
+                    )
+                )
+            self.request_count += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def send_action(self, action_name, payload, url, timeout):
+        self._acquire_slot()
+        try:
+            resp = self.session.post(
+                url,
+                data=json.dumps(payload, cls=PayloadEncoder),
+                headers={
+                    'Content-type': 'application/json',
+                    'Accept': 'application/json',
+                },
+                timeout=timeout
+            ).json()
+        finally:
+            self._slots.release()
+        # Raise on errors like skygear's HttpTransport instead of returning
+        # the error payload.
+        if 'error' in resp:
+            raise SkygearException.from_dict(resp['error'])
+        return resp
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pool_size': self.pool_size,
+                'requests': self.request_count,
+                'timeouts': self.timeouts,
+                'total_wait': self.total_wait,
+                'max_wait': self.max_wait,
+                'average_wait': (
+                    self.total_wait / self.request_count
+                    if self.request_count else 0.0
+                ),
+            }
+
+
+class PooledSkygearContainer(SkygearContainer):
+    def send_action(self, action_name, params, plugin_request=False,
+                    timeout=SOCIAL_FEED_CONTAINER_REQUEST_TIMEOUT):
+        return super().send_action(
+            action_name,
+            params,
+            plugin_request=plugin_request,
+            timeout=timeout
+        )
+
+
+def is_container_pool_enabled():
+    return (
+        SOCIAL_FEED_CONTAINER_POOL_SIZE > 0
+        and bool(SOCIAL_FEED_CONTAINER_ENDPOINT)
+    )
+
+
+def get_container(api_key):
+    if not is_container_pool_enabled():
+        return SkygearContainer(api_key=api_key)
+
+    global _pooled_transport
+    with _containers_lock:
+        if _pooled_transport is None:
+            _pooled_transport = PooledHttpTransport(
+                pool_size=SOCIAL_FEED_CONTAINER_POOL_SIZE,
+                pool_timeout=SOCIAL_FEED_CONTAINER_POOL_TIMEOUT
+            )
+        container = _containers.get(api_key)
+        if container is None:
+            container = PooledSkygearContainer(
+                endpoint=SOCIAL_FEED_CONTAINER_ENDPOINT,
+                api_key=api_key,
+                transport=_pooled_transport
+            )
+            _containers[api_key] = container
+        return container
+
+
+def register_get_container_pool_stats():
+    @op('social_feed:get_container_pool_stats', key_required=True)
+    def get_container_pool_stats():
+        if _pooled_transport is None:
+            return {}
+        return _pooled_transport.stats()
@@ -0,0 +1,18 @@
+import os
+
+import sqlalchemy as sa
+
+_engine = None
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = sa.create_engine(os.getenv('DATABASE_URL'))
+    return _engine
+
+
+def autocommit_conn():
+    return get_engine().connect().execution_options(
+        isolation_level='AUTOCOMMIT'
+    )
@@ -0,0 +1,71 @@
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_fanout_buffers = []
+
+
+class FanoutBuffer(object):
+    def __init__(self, flush_records, batch_size, batch_window):
+        self.flush_records = flush_records
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._records = []
+        self._lock = threading.Lock()
+        self._timer = None
+        _fanout_buffers.append(self)
+
+    def _take_records(self):
+        records = self._records
+        self._records = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return records
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            if len(self._records) < self.batch_size:
+                if self._timer is None:
+                    self._timer = threading.Timer(
+                        self.batch_window,
+                        self.flush
+                    )
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            records = self._take_records()
+        self._flush(records)
+
+    def flush(self):
+        with self._lock:
+            records = self._take_records()
+        self._flush(records)
+
+    def _flush(self, records):
+        if not records:
+            return
+        try:
+            self.flush_records(records)
+        except Exception:
+            logger.exception('Failed to fanout %d records', len(records))
+            if len(records) > 1:
+                # Retry one by one so a bad record or a transient error only
+                # loses the records that still fail, as without batching.
+                for record in records:
+                    self._flush_record(record)
+
+    def _flush_record(self, record):
+        try:
+            self.flush_records([record])
+        except Exception:
+            logger.exception('Failed to fanout record %s', record)
+
+
+@atexit.register
+def flush_fanout_buffers():
+    for fanout_buffer in _fanout_buffers:
+        fanout_buffer.flush()
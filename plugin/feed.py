@@ -0,0 +1,363 @@
+from datetime import datetime
+
+from skygear.error import (
+    InvalidArgument,
+    SkygearException,
+)
+import sqlalchemy as sa
+
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
+    SOCIAL_FEED_INDEX_RETENTION_MONTHS,
+    SOCIAL_FEED_MAX_FEED_LENGTH,
+    SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD,
+    SOCIAL_FEED_QUERY_PAGE_SIZE,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+from .partition import (
+    is_index_retention_enabled,
+)
+from .table_name import (
+    is_compact_index_storage,
+    name_for_pull_fanout_user_table,
+    name_for_relation_index,
+)
+
+# Cursors carry record_created_at.isoformat(), which omits the fraction when
+# it is zero.
+FEED_CURSOR_CREATED_AT_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S',
+]
+
+
+def sql_for_feed_sources(relation, record_type, after=None, limit_sql=None):
+    table_name = name_for_relation_index(
+        prefix=SOCIAL_FEED_TABLE_PREFIX,
+        relation=relation,
+        record_type=record_type
+    )
+    feed_sources = ['''
+        SELECT
+            {record_ref} as record_ref,
+            record_created_at,
+            '{record_type}'::text as record_type
+        FROM {db_name}.{table_name}
+        WHERE left_id = :my_user_id
+    '''.format(
+        db_name=DB_NAME,
+        table_name=table_name,
+        record_ref=sql_for_relation_index_value('record_ref'),
+        record_type=record_type
+    )]
+
+    if relation == 'following' and SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD:
+        feed_sources.append(sql_for_pull_fanout_feed_source(
+            record_type,
+            after,
+            limit_sql
+        ))
+
+    return feed_sources
+
+
+def sql_for_relations_feed_sources(relations, record_types, after=None,
+                                   limit_sql=None):
+    return [
+        feed_source
+        for relation in relations
+        for record_type in record_types
+        for feed_source in sql_for_feed_sources(
+            relation,
+            record_type,
+            after=after,
+            limit_sql=limit_sql
+        )
+    ]
+
+
+def sql_for_pull_fanout_feed_source(record_type, after, limit_sql):
+    # Each followed pull fanout user only contributes their newest records,
+    # read from the _owner_id, _created_at index of the record table. A page
+    # needs at most limit records of every followee; without a page, a
+    # trimmed feed keeps at most SOCIAL_FEED_MAX_FEED_LENGTH of them.
+    if limit_sql is None and SOCIAL_FEED_MAX_FEED_LENGTH > 0:
+        limit_sql = str(SOCIAL_FEED_MAX_FEED_LENGTH)
+
+    cursor_condition = ''
+    if after is not None:
+        cursor_condition = '''
+            AND record_table._created_at <= :after_created_at
+            AND (record_table._created_at, record_table._id)
+            < (:after_created_at, :after_id)
+        '''
+
+    limit_clause = ''
+    if limit_sql is not None:
+        limit_clause = 'LIMIT {0}'.format(limit_sql)
+
+    return '''
+        SELECT
+            followee_record.record_ref,
+            followee_record.record_created_at,
+            '{record_type}'::text as record_type
+        FROM {db_name}._follow f
+        JOIN {db_name}.{pull_fanout_user_table} pull_fanout_user
+        ON pull_fanout_user.user_id = f.right_id
+        LEFT JOIN {db_name}.user user_table
+        ON user_table._id = f.right_id
+        CROSS JOIN LATERAL (
+            SELECT
+                record_table._id as record_ref,
+                record_table._created_at as record_created_at
+            FROM {db_name}.{record_type} record_table
+            WHERE record_table._owner_id = f.right_id
+            {retention_condition}
+            {cursor_condition}
+            ORDER BY record_table._created_at DESC, record_table._id DESC
+            {limit_clause}
+        ) followee_record
+        WHERE f.left_id = :my_user_id
+        AND COALESCE(
+            user_table.social_feed_fanout_policy,
+            '{default_fanout_policy}'::jsonb
+        ) @> '{{"following": true}}'::jsonb
+    '''.format(
+        db_name=DB_NAME,
+        retention_condition=sql_for_index_retention_condition(
+            'record_table._created_at'
+        ),
+        cursor_condition=cursor_condition,
+        limit_clause=limit_clause,
+        pull_fanout_user_table=name_for_pull_fanout_user_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        record_type=record_type,
+        default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR
+    )
+
+
+def sql_for_index_retention_condition(created_at_column):
+    if not is_index_retention_enabled():
+        return ''
+
+    return '''
+        AND {created_at_column} >= (
+            date_trunc('month', timezone('UTC', now()))
+            - interval '{retention_months:d} months'
+        )
+    '''.format(
+        created_at_column=created_at_column,
+        retention_months=SOCIAL_FEED_INDEX_RETENTION_MONTHS
+    )
+
+
+def sql_for_relation_index_id(id_sql):
+    if is_compact_index_storage():
+        return '({0}) ::uuid'.format(id_sql)
+    return id_sql
+
+
+def sql_for_relation_index_value(column_sql):
+    if is_compact_index_storage():
+        return '{0} ::text'.format(column_sql)
+    return column_sql
+
+
+def sql_for_relation_index_insert(table_name, new_index_sql,
+                                  returning_sql=''):
+    if is_compact_index_storage():
+        return '''
+            INSERT INTO {db_name}.{table_name} (
+                left_id,
+                right_id,
+                record_ref,
+                record_created_at
+            )
+            SELECT
+                new_index.left_id ::uuid,
+                new_index.right_id ::uuid,
+                new_index.record_ref ::uuid,
+                new_index.record_created_at
+            FROM ({new_index_sql}) new_index
+            WHERE TRUE
+            {retention_condition}
+            ON CONFLICT DO NOTHING
+            {returning_sql}
+        '''.format(
+            db_name=DB_NAME,
+            table_name=table_name,
+            new_index_sql=new_index_sql,
+            returning_sql=returning_sql,
+            retention_condition=sql_for_index_retention_condition(
+                'new_index.record_created_at'
+            )
+        )
+
+    return '''
+        INSERT INTO {db_name}.{table_name} (
+            _id,
+            _database_id,
+            _owner_id,
+            _created_at,
+            _created_by,
+            _updated_at,
+            _updated_by,
+            _access,
+            left_id,
+            right_id,
+            record_ref,
+            record_created_at
+        )
+        SELECT
+            uuid_generate_v4() as _id,
+            '' as _database_id,
+            new_index.left_id as _owner_id,
+            current_timestamp as _created_at,
+            new_index.left_id as _created_by,
+            current_timestamp as _updated_at,
+            new_index.left_id as _updated_by,
+            '[]'::jsonb as _access,
+            new_index.left_id,
+            new_index.right_id,
+            new_index.record_ref,
+            new_index.record_created_at
+        FROM ({new_index_sql}) new_index
+        ON CONFLICT (left_id, right_id, record_ref) DO NOTHING
+        {returning_sql}
+    '''.format(
+        db_name=DB_NAME,
+        table_name=table_name,
+        new_index_sql=new_index_sql,
+        returning_sql=returning_sql
+    )
+
+
+def sql_for_pull_fanout_user_exclusion(owner_id_column):
+    if not SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD:
+        return ''
+
+    return '''
+        AND {owner_id_column} NOT IN (
+            SELECT user_id
+            FROM {db_name}.{pull_fanout_user_table}
+        )
+    '''.format(
+        db_name=DB_NAME,
+        pull_fanout_user_table=name_for_pull_fanout_user_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        owner_id_column=owner_id_column
+    )
+
+
+def sql_for_feed(feed_sources):
+    return '\nUNION\n'.join(
+        '({0})'.format(feed_source) for feed_source in feed_sources
+    )
+
+
+def sql_for_feed_page(feed_sources, after):
+    cursor_condition = ''
+    if after is not None:
+        cursor_condition = '''
+            AND record_created_at <= :after_created_at
+            AND (record_created_at, record_ref)
+            < (:after_created_at, :after_id)
+        '''
+
+    feed_source_pages = [
+        '''
+            SELECT *
+            FROM ({feed_source}) feed_source
+            WHERE TRUE
+            {cursor_condition}
+            ORDER BY record_created_at DESC, record_ref DESC
+            LIMIT :limit
+        '''.format(
+            feed_source=feed_source,
+            cursor_condition=cursor_condition
+        )
+        for feed_source in feed_sources
+    ]
+    return '''
+        SELECT record_ref as id, record_created_at, record_type
+        FROM ({feed}) feed
+        ORDER BY record_created_at DESC, record_ref DESC
+        LIMIT :limit
+    '''.format(feed=sql_for_feed(feed_source_pages))
+
+
+def fetch_feed_records_ids(conn, feed_sources, user_id):
+    get_records_ids_sql = sa.text('''
+        SELECT record_ref as id
+        FROM ({feed}) feed
+    '''.format(feed=sql_for_feed(feed_sources)))
+    results = conn.execute(get_records_ids_sql, my_user_id=user_id)
+    return [record.id for record in results]
+
+
+def fetch_feed_page(conn, feed_sources, user_id, after, limit):
+    params = {
+        'my_user_id': user_id,
+        'limit': limit,
+    }
+    if after is not None:
+        params['after_created_at'] = after['created_at']
+        params['after_id'] = after['id']
+
+    get_records_ids_page_sql = sa.text(sql_for_feed_page(feed_sources, after))
+    return conn.execute(get_records_ids_page_sql, **params).fetchall()
+
+
+def feed_page_limit(limit):
+    if limit is None:
+        return None
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0:
+        raise SkygearException(
+            'limit must be a positive integer',
+            code=InvalidArgument
+        )
+    return min(limit, SOCIAL_FEED_QUERY_PAGE_SIZE)
+
+
+def feed_page_cursor(after):
+    if after is None:
+        return None
+    if (
+        not isinstance(after, dict)
+        or not isinstance(after.get('created_at'), str)
+        or not isinstance(after.get('id'), str)
+    ):
+        raise SkygearException(
+            'after must be a cursor returned by a previous page',
+            code=InvalidArgument
+        )
+    for created_at_format in FEED_CURSOR_CREATED_AT_FORMATS:
+        try:
+            datetime.strptime(after['created_at'], created_at_format)
+        except ValueError:
+            continue
+        return {
+            'created_at': after['created_at'],
+            'id': after['id'],
+        }
+    raise SkygearException(
+        'after must be a cursor returned by a previous page',
+        code=InvalidArgument
+    )
+
+
+def cursor_for_feed_page(page, limit):
+    if not page or len(page) < limit:
+        return None
+
+    last_indexed_record = page[-1]
+    if last_indexed_record.record_created_at is None:
+        return None
+
+    return {
+        'created_at': last_indexed_record.record_created_at.isoformat(),
+        'id': last_indexed_record.id,
+    }
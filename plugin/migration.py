@@ -0,0 +1,631 @@
+import sqlalchemy as sa
+
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_INDEX_FILLFACTOR,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+from .partition import (
+    create_relation_index_partitions,
+    is_index_retention_enabled,
+    sql_for_relation_index_partition_by,
+)
+from .table_name import (
+    is_compact_index_storage,
+    name_for_backfill_watermark_table,
+    name_for_feed_length_table,
+    name_for_feed_version_table,
+    name_for_mutual_friend_table,
+    name_for_orphan_gc_cursor_table,
+    name_for_pull_fanout_user_table,
+    name_for_reindex_job_table,
+    name_for_table_index,
+    name_for_work_queue_table,
+)
+
+SCHEMA_VERSION_TABLE = SOCIAL_FEED_TABLE_PREFIX + '_schema_version'
+PLUGIN_SCHEMA_NAME = SOCIAL_FEED_TABLE_PREFIX
+
+
+def create_schema_version_table(conn):
+    create_schema_version_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{schema_version_table} (
+            name text PRIMARY KEY,
+            version integer NOT NULL,
+            applied_at timestamp without time zone NOT NULL
+        )
+    '''.format(
+        db_name=DB_NAME,
+        schema_version_table=SCHEMA_VERSION_TABLE
+    ))
+    conn.execute(create_schema_version_table_sql)
+
+
+def get_schema_version(conn, name):
+    get_schema_version_sql = sa.text('''
+        SELECT version
+        FROM {db_name}.{schema_version_table}
+        WHERE name = :name
+    '''.format(
+        db_name=DB_NAME,
+        schema_version_table=SCHEMA_VERSION_TABLE
+    ))
+    return conn.execute(get_schema_version_sql, name=name).scalar() or 0
+
+
+def set_schema_version(conn, name, version):
+    set_schema_version_sql = sa.text('''
+        INSERT INTO {db_name}.{schema_version_table} (
+            name,
+            version,
+            applied_at
+        )
+        VALUES (:name, :version, timezone('UTC', now()))
+        ON CONFLICT (name) DO UPDATE
+        SET version = excluded.version,
+            applied_at = excluded.applied_at
+    '''.format(
+        db_name=DB_NAME,
+        schema_version_table=SCHEMA_VERSION_TABLE
+    ))
+    conn.execute(set_schema_version_sql, name=name, version=version)
+
+
+def create_index_concurrently(conn, table_name, index_suffix, columns,
+                              unique=False, where=None, fillfactor=None):
+    index_name = name_for_table_index(table_name, index_suffix)
+
+    get_index_validity_sql = sa.text('''
+        SELECT i.indisvalid
+        FROM pg_catalog.pg_index i
+        JOIN pg_catalog.pg_class c ON c.oid = i.indexrelid
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :db_name
+        AND c.relname = :index_name
+    ''')
+    is_valid = conn.execute(
+        get_index_validity_sql,
+        db_name=DB_NAME,
+        index_name=index_name
+    ).scalar()
+    if is_valid is True:
+        return
+
+    if is_valid is False:
+        drop_invalid_index_sql = sa.text('''
+            DROP INDEX CONCURRENTLY IF EXISTS {db_name}.{index_name}
+        '''.format(db_name=DB_NAME, index_name=index_name))
+        conn.execute(drop_invalid_index_sql)
+
+    get_table_kind_sql = sa.text('''
+        SELECT c.relkind
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :db_name
+        AND c.relname = :table_name
+    ''')
+    table_kind = conn.execute(
+        get_table_kind_sql,
+        db_name=DB_NAME,
+        table_name=table_name
+    ).scalar()
+
+    # Partitioned tables cannot be indexed concurrently, the index is
+    # created on the parent and cascaded to every partition instead.
+    create_index_sql = sa.text('''
+        CREATE {unique} INDEX {concurrently} IF NOT EXISTS {index_name}
+        ON {db_name}.{table_name} ({columns})
+        {storage_parameters}
+        {where}
+    '''.format(
+        db_name=DB_NAME,
+        table_name=table_name,
+        index_name=index_name,
+        unique='UNIQUE' if unique else '',
+        concurrently='' if table_kind == 'p' else 'CONCURRENTLY',
+        columns=', '.join(columns),
+        storage_parameters=(
+            'WITH (fillfactor = {0:d})'.format(fillfactor)
+            if fillfactor else ''
+        ),
+        where='WHERE ' + where if where else ''
+    ))
+    conn.execute(create_index_sql)
+
+
+def backfill_relation_index_record_created_at(conn, table_name,
+                                              record_type):
+    backfill_sql = sa.text('''
+        UPDATE {db_name}.{table_name} feed_table
+        SET record_created_at = record_table._created_at
+        FROM {db_name}.{record_type} record_table
+        WHERE record_table._id = feed_table.record_ref
+        AND feed_table.record_created_at IS NULL
+    '''.format(
+        db_name=DB_NAME,
+        table_name=table_name,
+        record_type=record_type
+    ))
+    conn.execute(backfill_sql)
+
+
+def create_relation_index_record_ref_key(conn, table_name, record_type):
+    remove_duplicated_index_sql = sa.text('''
+        DELETE FROM {db_name}.{table_name} feed_table
+        USING {db_name}.{table_name} duplicated_feed_table
+        WHERE feed_table.left_id = duplicated_feed_table.left_id
+        AND feed_table.right_id = duplicated_feed_table.right_id
+        AND feed_table.record_ref = duplicated_feed_table.record_ref
+        AND feed_table._id > duplicated_feed_table._id
+    '''.format(db_name=DB_NAME, table_name=table_name))
+    conn.execute(remove_duplicated_index_sql)
+
+    create_index_concurrently(
+        conn,
+        table_name=table_name,
+        index_suffix='record_ref_key',
+        columns=['left_id', 'right_id', 'record_ref'],
+        unique=True
+    )
+
+
+def create_relation_index_feed_order_index(conn, table_name, record_type):
+    create_index_concurrently(
+        conn,
+        table_name=table_name,
+        index_suffix='feed_order_idx',
+        columns=['left_id', 'record_created_at DESC', 'record_ref DESC']
+    )
+
+
+def create_relation_index_right_id_index(conn, table_name, record_type):
+    create_index_concurrently(
+        conn,
+        table_name=table_name,
+        index_suffix='right_id_idx',
+        columns=['right_id', 'left_id']
+    )
+
+
+def create_relation_index_record_ref_index(conn, table_name, record_type):
+    create_index_concurrently(
+        conn,
+        table_name=table_name,
+        index_suffix='record_ref_idx',
+        columns=['record_ref']
+    )
+
+
+RELATION_INDEX_MIGRATIONS = [
+    backfill_relation_index_record_created_at,
+    create_relation_index_record_ref_key,
+    create_relation_index_feed_order_index,
+    create_relation_index_right_id_index,
+    create_relation_index_record_ref_index,
+]
+
+
+def create_compact_relation_index_table(conn, table_name, record_type):
+    primary_key_columns = ['left_id', 'right_id', 'record_ref']
+    partition_by_sql = sql_for_relation_index_partition_by()
+    storage_parameters_sql = 'WITH (fillfactor = 100)'
+    if partition_by_sql:
+        storage_parameters_sql = ''
+    if is_index_retention_enabled():
+        primary_key_columns.append('record_created_at')
+
+    create_compact_relation_index_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{table_name} (
+            left_id uuid NOT NULL,
+            right_id uuid NOT NULL,
+            record_ref uuid NOT NULL,
+            record_created_at timestamp without time zone NOT NULL,
+            CONSTRAINT {primary_key_name}
+            PRIMARY KEY ({primary_key_columns})
+            WITH (fillfactor = {fillfactor:d})
+        )
+        {partition_by_sql}
+        {storage_parameters_sql}
+    '''.format(
+        db_name=DB_NAME,
+        table_name=table_name,
+        primary_key_name=name_for_table_index(table_name, 'pkey'),
+        primary_key_columns=', '.join(primary_key_columns),
+        fillfactor=SOCIAL_FEED_INDEX_FILLFACTOR,
+        partition_by_sql=partition_by_sql,
+        storage_parameters_sql=storage_parameters_sql
+    ))
+    conn.execute(create_compact_relation_index_table_sql)
+
+    create_relation_index_partitions(conn, table_name)
+
+
+def create_compact_relation_index_feed_order_index(conn, table_name,
+                                                   record_type):
+    create_index_concurrently(
+        conn,
+        table_name=table_name,
+        index_suffix='feed_order_idx',
+        columns=['left_id', 'record_created_at DESC', 'record_ref DESC'],
+        fillfactor=SOCIAL_FEED_INDEX_FILLFACTOR
+    )
+
+
+def create_compact_relation_index_right_id_index(conn, table_name,
+                                                 record_type):
+    create_index_concurrently(
+        conn,
+        table_name=table_name,
+        index_suffix='right_id_idx',
+        columns=['right_id', 'left_id'],
+        fillfactor=SOCIAL_FEED_INDEX_FILLFACTOR
+    )
+
+
+def create_compact_relation_index_record_ref_index(conn, table_name,
+                                                   record_type):
+    create_index_concurrently(
+        conn,
+        table_name=table_name,
+        index_suffix='record_ref_idx',
+        columns=['record_ref'],
+        fillfactor=SOCIAL_FEED_INDEX_FILLFACTOR
+    )
+
+
+COMPACT_RELATION_INDEX_MIGRATIONS = [
+    create_compact_relation_index_table,
+    create_compact_relation_index_feed_order_index,
+    create_compact_relation_index_right_id_index,
+    create_compact_relation_index_record_ref_index,
+]
+
+
+def create_pull_fanout_user_table(conn):
+    create_pull_fanout_user_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{pull_fanout_user_table} (
+            user_id text PRIMARY KEY,
+            created_at timestamp without time zone NOT NULL
+        )
+    '''.format(
+        db_name=DB_NAME,
+        pull_fanout_user_table=name_for_pull_fanout_user_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    conn.execute(create_pull_fanout_user_table_sql)
+
+
+def create_user_fanout_policy_dirty_index(conn):
+    create_index_concurrently(
+        conn,
+        table_name='user',
+        index_suffix='social_feed_fanout_policy_dirty_idx',
+        columns=['_id'],
+        where='social_feed_fanout_policy_is_dirty IS TRUE'
+    )
+
+
+def create_feed_length_table(conn):
+    create_feed_length_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{feed_length_table} (
+            table_name text NOT NULL,
+            left_id text NOT NULL,
+            length bigint NOT NULL,
+            PRIMARY KEY (table_name, left_id)
+        )
+    '''.format(
+        db_name=DB_NAME,
+        feed_length_table=name_for_feed_length_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    conn.execute(create_feed_length_table_sql)
+
+
+def create_reindex_job_table(conn):
+    reindex_job_table = name_for_reindex_job_table(SOCIAL_FEED_TABLE_PREFIX)
+    create_reindex_job_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{reindex_job_table} (
+            id bigserial PRIMARY KEY,
+            user_id text NOT NULL,
+            relation text NOT NULL,
+            status text NOT NULL,
+            total_connections integer,
+            processed_connections integer NOT NULL,
+            connection_cursor text,
+            created_at timestamp without time zone NOT NULL,
+            updated_at timestamp without time zone NOT NULL
+        )
+    '''.format(
+        db_name=DB_NAME,
+        reindex_job_table=reindex_job_table
+    ))
+    conn.execute(create_reindex_job_table_sql)
+
+    create_index_concurrently(
+        conn,
+        table_name=reindex_job_table,
+        index_suffix='pending_key',
+        columns=['user_id', 'relation'],
+        unique=True,
+        where="status = 'pending'"
+    )
+    create_index_concurrently(
+        conn,
+        table_name=reindex_job_table,
+        index_suffix='user_id_idx',
+        columns=['user_id', 'relation', 'id DESC']
+    )
+
+
+def create_work_queue_table(conn):
+    work_queue_table = name_for_work_queue_table(SOCIAL_FEED_TABLE_PREFIX)
+    create_work_queue_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{work_queue_table} (
+            id bigserial PRIMARY KEY,
+            name text NOT NULL,
+            payload jsonb NOT NULL,
+            status text NOT NULL,
+            attempts integer NOT NULL,
+            last_error text,
+            run_at timestamp without time zone NOT NULL,
+            created_at timestamp without time zone NOT NULL
+        )
+    '''.format(
+        db_name=DB_NAME,
+        work_queue_table=work_queue_table
+    ))
+    conn.execute(create_work_queue_table_sql)
+
+    create_index_concurrently(
+        conn,
+        table_name=work_queue_table,
+        index_suffix='pending_idx',
+        columns=['run_at', 'id'],
+        where="status = 'pending'"
+    )
+
+
+def create_backfill_watermark_table(conn):
+    create_backfill_watermark_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{backfill_watermark_table} (
+            table_name text NOT NULL,
+            left_id text NOT NULL,
+            right_id text NOT NULL,
+            unindexed_until timestamp without time zone,
+            PRIMARY KEY (table_name, left_id, right_id)
+        )
+    '''.format(
+        db_name=DB_NAME,
+        backfill_watermark_table=name_for_backfill_watermark_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    conn.execute(create_backfill_watermark_table_sql)
+
+
+def create_mutual_friend_table(conn):
+    mutual_friend_table = name_for_mutual_friend_table(
+        SOCIAL_FEED_TABLE_PREFIX
+    )
+    create_mutual_friend_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{mutual_friend_table} (
+            left_id text NOT NULL,
+            right_id text NOT NULL,
+            PRIMARY KEY (left_id, right_id)
+        )
+    '''.format(
+        db_name=DB_NAME,
+        mutual_friend_table=mutual_friend_table
+    ))
+    conn.execute(create_mutual_friend_table_sql)
+
+    # Both directions of a friendship are stored, so the friends of a user
+    # are always looked up by left_id. The pair is locked while the edge
+    # changes, so two users adding each other at the same time still see the
+    # other side of the friendship.
+    create_mutual_friend_function_sql = sa.text('''
+        CREATE OR REPLACE FUNCTION {db_name}.{mutual_friend_table}_sync()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                PERFORM pg_advisory_xact_lock(hashtext(
+                    LEAST(OLD.left_id, OLD.right_id) || '/'
+                    || GREATEST(OLD.left_id, OLD.right_id)
+                ));
+                DELETE FROM {db_name}.{mutual_friend_table}
+                WHERE (left_id = OLD.left_id AND right_id = OLD.right_id)
+                OR (left_id = OLD.right_id AND right_id = OLD.left_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_advisory_xact_lock(hashtext(
+                    LEAST(NEW.left_id, NEW.right_id) || '/'
+                    || GREATEST(NEW.left_id, NEW.right_id)
+                ));
+                INSERT INTO {db_name}.{mutual_friend_table} (
+                    left_id,
+                    right_id
+                )
+                SELECT f.right_id, f.left_id
+                FROM {db_name}._friend f
+                WHERE f.left_id = NEW.right_id
+                AND f.right_id = NEW.left_id
+                UNION ALL
+                SELECT f.left_id, f.right_id
+                FROM {db_name}._friend f
+                WHERE f.left_id = NEW.right_id
+                AND f.right_id = NEW.left_id
+                ON CONFLICT DO NOTHING;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    '''.format(
+        db_name=DB_NAME,
+        mutual_friend_table=mutual_friend_table
+    ))
+    conn.execute(create_mutual_friend_function_sql)
+
+    drop_mutual_friend_trigger_sql = sa.text('''
+        DROP TRIGGER IF EXISTS {mutual_friend_table}_sync
+        ON {db_name}._friend
+    '''.format(
+        db_name=DB_NAME,
+        mutual_friend_table=mutual_friend_table
+    ))
+    conn.execute(drop_mutual_friend_trigger_sql)
+
+    create_mutual_friend_trigger_sql = sa.text('''
+        CREATE TRIGGER {mutual_friend_table}_sync
+        AFTER INSERT OR UPDATE OR DELETE ON {db_name}._friend
+        FOR EACH ROW
+        EXECUTE PROCEDURE {db_name}.{mutual_friend_table}_sync()
+    '''.format(
+        db_name=DB_NAME,
+        mutual_friend_table=mutual_friend_table
+    ))
+    conn.execute(create_mutual_friend_trigger_sql)
+
+    fill_mutual_friend_table_sql = sa.text('''
+        INSERT INTO {db_name}.{mutual_friend_table} (left_id, right_id)
+        SELECT f1.left_id, f1.right_id
+        FROM {db_name}._friend f1
+        JOIN {db_name}._friend f2
+        ON f1.right_id = f2.left_id
+        AND f1.left_id = f2.right_id
+        ON CONFLICT DO NOTHING
+    '''.format(
+        db_name=DB_NAME,
+        mutual_friend_table=mutual_friend_table
+    ))
+    conn.execute(fill_mutual_friend_table_sql)
+
+
+def create_orphan_gc_cursor_table(conn):
+    create_orphan_gc_cursor_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{orphan_gc_cursor_table} (
+            table_name text PRIMARY KEY,
+            left_id text,
+            right_id text,
+            record_ref text,
+            updated_at timestamp without time zone NOT NULL
+        )
+    '''.format(
+        db_name=DB_NAME,
+        orphan_gc_cursor_table=name_for_orphan_gc_cursor_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    conn.execute(create_orphan_gc_cursor_table_sql)
+
+
+def create_feed_version_table(conn):
+    create_feed_version_table_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{feed_version_table} (
+            left_id text PRIMARY KEY,
+            version bigint NOT NULL
+        )
+    '''.format(
+        db_name=DB_NAME,
+        feed_version_table=name_for_feed_version_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    conn.execute(create_feed_version_table_sql)
+
+
+def create_backfill_watermark_left_id_index(conn):
+    create_index_concurrently(
+        conn,
+        table_name=name_for_backfill_watermark_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        index_suffix='left_id_idx',
+        columns=['left_id']
+    )
+
+
+def add_reindex_job_retry_columns(conn):
+    add_reindex_job_retry_columns_sql = sa.text('''
+        ALTER TABLE {db_name}.{reindex_job_table}
+        ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS last_error text,
+        ADD COLUMN IF NOT EXISTS run_after timestamp without time zone
+            NOT NULL DEFAULT timezone('UTC', now())
+    '''.format(
+        db_name=DB_NAME,
+        reindex_job_table=name_for_reindex_job_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    conn.execute(add_reindex_job_retry_columns_sql)
+
+
+PLUGIN_MIGRATIONS = [
+    create_pull_fanout_user_table,
+    create_user_fanout_policy_dirty_index,
+    create_feed_length_table,
+    create_reindex_job_table,
+    create_work_queue_table,
+    create_backfill_watermark_table,
+    create_mutual_friend_table,
+    create_orphan_gc_cursor_table,
+    create_feed_version_table,
+    create_backfill_watermark_left_id_index,
+    add_reindex_job_retry_columns,
+]
+
+
+def create_record_owner_index(conn, record_type):
+    create_index_concurrently(
+        conn,
+        table_name=record_type,
+        index_suffix='social_feed_owner_idx',
+        columns=['_owner_id', '_created_at DESC', '_id DESC']
+    )
+
+
+RECORD_MIGRATIONS = [
+    create_record_owner_index,
+]
+
+
+def migrate(conn, name, migrations, **kwargs):
+    current_version = get_schema_version(conn, name)
+    for version, migration in enumerate(migrations, start=1):
+        if version <= current_version:
+            continue
+        migration(conn, **kwargs)
+        set_schema_version(conn, name, version)
+
+
+def migrate_relation_index(conn, table_name, record_type):
+    migrations = RELATION_INDEX_MIGRATIONS
+    if is_compact_index_storage():
+        migrations = COMPACT_RELATION_INDEX_MIGRATIONS
+
+    migrate(
+        conn,
+        name=table_name,
+        migrations=migrations,
+        table_name=table_name,
+        record_type=record_type
+    )
+
+
+def migrate_plugin(conn):
+    migrate(
+        conn,
+        name=PLUGIN_SCHEMA_NAME,
+        migrations=PLUGIN_MIGRATIONS
+    )
+
+
+def migrate_record(conn, record_type):
+    migrate(
+        conn,
+        name=record_type,
+        migrations=RECORD_MIGRATIONS,
+        record_type=record_type
+    )
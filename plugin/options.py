@@ -11,5 +11,110 @@ SOCIAL_FEED_FANOUT_POLICY_JSON_STR = os.getenv(
     '{"friends": true, "following": true}'
 )
 SOCIAL_FEED_FANOUT_POLICY = json.loads(SOCIAL_FEED_FANOUT_POLICY_JSON_STR)
+SOCIAL_FEED_QUERY_PAGE_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_QUERY_PAGE_SIZE', '50')
+)
+SOCIAL_FEED_QUERY_ENGINE = os.getenv(
+    'SKYGEAR_SOCIAL_FEED_QUERY_ENGINE',
+    'record_query'
+)
+SOCIAL_FEED_FANOUT_BATCH_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_FANOUT_BATCH_SIZE', '1')
+)
+SOCIAL_FEED_FANOUT_BATCH_WINDOW = float(
+    os.getenv('SKYGEAR_SOCIAL_FEED_FANOUT_BATCH_WINDOW', '1')
+)
+SOCIAL_FEED_FANOUT_POLICY_CACHE_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_FANOUT_POLICY_CACHE_SIZE', '10000')
+)
+SOCIAL_FEED_FANOUT_POLICY_CACHE_TTL = float(
+    os.getenv('SKYGEAR_SOCIAL_FEED_FANOUT_POLICY_CACHE_TTL', '5')
+)
+SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD', '0')
+)
+SOCIAL_FEED_AUDIT_BATCH_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_AUDIT_BATCH_SIZE', '100')
+)
+SOCIAL_FEED_AUDIT_SHARDS = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_AUDIT_SHARDS', '1')
+)
+SOCIAL_FEED_FANOUT_POLICY_NOTIFY_ENABLED = os.getenv(
+    'SKYGEAR_SOCIAL_FEED_FANOUT_POLICY_NOTIFY_ENABLED',
+    'false'
+).lower() == 'true'
+SOCIAL_FEED_INDEX_STORAGE = os.getenv(
+    'SKYGEAR_SOCIAL_FEED_INDEX_STORAGE',
+    'record'
+)
+SOCIAL_FEED_INDEX_FILLFACTOR = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_INDEX_FILLFACTOR', '80')
+)
+SOCIAL_FEED_INDEX_PARTITIONS = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_INDEX_PARTITIONS', '0')
+)
+SOCIAL_FEED_INDEX_RETENTION_MONTHS = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_INDEX_RETENTION_MONTHS', '0')
+)
+SOCIAL_FEED_MAX_FEED_LENGTH = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_MAX_FEED_LENGTH', '0')
+)
+SOCIAL_FEED_TRIM_BATCH_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_TRIM_BATCH_SIZE', '1000')
+)
+SOCIAL_FEED_REINDEX_CHUNK_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_REINDEX_CHUNK_SIZE', '100')
+)
+SOCIAL_FEED_WORK_QUEUE_ENABLED = os.getenv(
+    'SKYGEAR_SOCIAL_FEED_WORK_QUEUE_ENABLED',
+    'false'
+).lower() == 'true'
+SOCIAL_FEED_WORK_QUEUE_WORKERS = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_WORK_QUEUE_WORKERS', '1')
+)
+SOCIAL_FEED_WORK_QUEUE_POLL_INTERVAL = float(
+    os.getenv('SKYGEAR_SOCIAL_FEED_WORK_QUEUE_POLL_INTERVAL', '1')
+)
+SOCIAL_FEED_WORK_QUEUE_MAX_ATTEMPTS = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_WORK_QUEUE_MAX_ATTEMPTS', '5')
+)
+SOCIAL_FEED_BACKFILL_RECORDS = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_BACKFILL_RECORDS', '0')
+)
+SOCIAL_FEED_BACKFILL_DAYS = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_BACKFILL_DAYS', '0')
+)
+SOCIAL_FEED_BACKFILL_BATCH_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_BACKFILL_BATCH_SIZE', '100')
+)
+SOCIAL_FEED_ORPHAN_GC_CHUNK_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_ORPHAN_GC_CHUNK_SIZE', '1000')
+)
+SOCIAL_FEED_PAGE_CACHE_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_PAGE_CACHE_SIZE', '0')
+)
+SOCIAL_FEED_PAGE_CACHE_TTL = float(
+    os.getenv('SKYGEAR_SOCIAL_FEED_PAGE_CACHE_TTL', '60')
+)
+SOCIAL_FEED_PAGE_CACHE_BACKEND = os.getenv(
+    'SKYGEAR_SOCIAL_FEED_PAGE_CACHE_BACKEND',
+    'memory'
+)
+SOCIAL_FEED_CONTAINER_POOL_SIZE = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_CONTAINER_POOL_SIZE', '0')
+)
+SOCIAL_FEED_CONTAINER_POOL_TIMEOUT = float(
+    os.getenv('SKYGEAR_SOCIAL_FEED_CONTAINER_POOL_TIMEOUT', '5')
+)
+SOCIAL_FEED_CONTAINER_REQUEST_TIMEOUT = float(
+    os.getenv('SKYGEAR_SOCIAL_FEED_CONTAINER_REQUEST_TIMEOUT', '60')
+)
+SOCIAL_FEED_CONTAINER_ENDPOINT = os.getenv(
+    'SKYGEAR_SOCIAL_FEED_CONTAINER_ENDPOINT',
+    ''
+)
+SOCIAL_FEED_RECORD_TYPE_PARALLELISM = int(
+    os.getenv('SKYGEAR_SOCIAL_FEED_RECORD_TYPE_PARALLELISM', '1')
+)
 
 DB_NAME = 'app_' + SKYGEAR_APP_NAME
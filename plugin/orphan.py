@@ -0,0 +1,192 @@
+from skygear import (
+    every,
+)
+from skygear.utils import db
+import sqlalchemy as sa
+
+from .feed import (
+    sql_for_relation_index_id,
+    sql_for_relation_index_value,
+)
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_ORPHAN_GC_CHUNK_SIZE,
+    SOCIAL_FEED_RECORD_TYPES,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+from .page_cache import (
+    sql_for_versioned_index_change,
+)
+from .table_name import (
+    name_for_orphan_gc_cursor_table,
+    name_for_relation_index,
+)
+
+
+def lock_orphan_gc_cursor(conn, table_name):
+    orphan_gc_cursor_table = name_for_orphan_gc_cursor_table(
+        SOCIAL_FEED_TABLE_PREFIX
+    )
+    create_cursor_sql = sa.text('''
+        INSERT INTO {db_name}.{orphan_gc_cursor_table} (
+            table_name,
+            updated_at
+        )
+        VALUES (:table_name, timezone('UTC', now()))
+        ON CONFLICT (table_name) DO NOTHING
+    '''.format(
+        db_name=DB_NAME,
+        orphan_gc_cursor_table=orphan_gc_cursor_table
+    ))
+    conn.execute(create_cursor_sql, table_name=table_name)
+
+    lock_cursor_sql = sa.text('''
+        SELECT left_id, right_id, record_ref
+        FROM {db_name}.{orphan_gc_cursor_table}
+        WHERE table_name = :table_name
+        FOR UPDATE SKIP LOCKED
+    '''.format(
+        db_name=DB_NAME,
+        orphan_gc_cursor_table=orphan_gc_cursor_table
+    ))
+    return conn.execute(lock_cursor_sql, table_name=table_name).first()
+
+
+def sql_for_index_key_after(key_name):
+    return '''
+        (left_id, right_id, record_ref) > (
+            {left_id},
+            {right_id},
+            {record_ref}
+        )
+    '''.format(
+        left_id=sql_for_relation_index_id(':{0}_left_id'.format(key_name)),
+        right_id=sql_for_relation_index_id(':{0}_right_id'.format(key_name)),
+        record_ref=sql_for_relation_index_id(
+            ':{0}_record_ref'.format(key_name)
+        )
+    )
+
+
+def collect_orphan_index_chunk(table_name, record_type):
+    with db.conn() as conn:
+        cursor = lock_orphan_gc_cursor(conn, table_name)
+        if cursor is None:
+            return False
+
+        params = {}
+        chunk_conditions = ['TRUE']
+        if cursor.left_id is not None:
+            chunk_conditions.append(sql_for_index_key_after('cursor'))
+            params['cursor_left_id'] = cursor.left_id
+            params['cursor_right_id'] = cursor.right_id
+            params['cursor_record_ref'] = cursor.record_ref
+
+        get_chunk_end_sql = sa.text('''
+            SELECT
+                {left_id} as end_left_id,
+                {right_id} as end_right_id,
+                {record_ref} as end_record_ref
+            FROM {db_name}.{table_name}
+            WHERE {chunk_conditions}
+            ORDER BY left_id, right_id, record_ref
+            OFFSET :chunk_size - 1
+            LIMIT 1
+        '''.format(
+            db_name=DB_NAME,
+            table_name=table_name,
+            left_id=sql_for_relation_index_value('left_id'),
+            right_id=sql_for_relation_index_value('right_id'),
+            record_ref=sql_for_relation_index_value('record_ref'),
+            chunk_conditions=' AND '.join(chunk_conditions)
+        ))
+        chunk_end = conn.execute(
+            get_chunk_end_sql,
+            chunk_size=SOCIAL_FEED_ORPHAN_GC_CHUNK_SIZE,
+            **params
+        ).first()
+        if chunk_end is not None:
+            chunk_conditions.append(
+                'NOT {0}'.format(sql_for_index_key_after('chunk_end'))
+            )
+            params['chunk_end_left_id'] = chunk_end.end_left_id
+            params['chunk_end_right_id'] = chunk_end.end_right_id
+            params['chunk_end_record_ref'] = chunk_end.end_record_ref
+
+        # The readers of removed rows get their feed version bumped in the
+        # same statement so cached pages stop serving the removed records.
+        remove_orphan_index_sql = sa.text(sql_for_versioned_index_change('''
+            DELETE FROM {db_name}.{table_name} feed_table
+            WHERE {chunk_conditions}
+            AND (
+                NOT EXISTS (
+                    SELECT 1
+                    FROM {db_name}.{record_type} record_table
+                    WHERE record_table._id = {feed_record_ref}
+                )
+                OR NOT EXISTS (
+                    SELECT 1
+                    FROM {db_name}._user u
+                    WHERE u.id = {feed_left_id}
+                )
+                OR NOT EXISTS (
+                    SELECT 1
+                    FROM {db_name}._user u
+                    WHERE u.id = {feed_right_id}
+                )
+            )
+        '''.format(
+            db_name=DB_NAME,
+            table_name=table_name,
+            record_type=record_type,
+            chunk_conditions=' AND '.join(chunk_conditions),
+            feed_record_ref=sql_for_relation_index_value(
+                'feed_table.record_ref'
+            ),
+            feed_left_id=sql_for_relation_index_value('feed_table.left_id'),
+            feed_right_id=sql_for_relation_index_value('feed_table.right_id')
+        )))
+        conn.execute(remove_orphan_index_sql, **params)
+
+        # The cursor goes back to the start of the table after the last chunk
+        # so the next run walks the whole table again.
+        update_cursor_sql = sa.text('''
+            UPDATE {db_name}.{orphan_gc_cursor_table}
+            SET left_id = :left_id,
+                right_id = :right_id,
+                record_ref = :record_ref,
+                updated_at = timezone('UTC', now())
+            WHERE table_name = :table_name
+        '''.format(
+            db_name=DB_NAME,
+            orphan_gc_cursor_table=name_for_orphan_gc_cursor_table(
+                SOCIAL_FEED_TABLE_PREFIX
+            )
+        ))
+        next_cursor = {
+            'left_id': None,
+            'right_id': None,
+            'record_ref': None,
+        }
+        if chunk_end is not None:
+            next_cursor = {
+                'left_id': chunk_end.end_left_id,
+                'right_id': chunk_end.end_right_id,
+                'record_ref': chunk_end.end_record_ref,
+            }
+        conn.execute(update_cursor_sql, table_name=table_name, **next_cursor)
+    return chunk_end is not None
+
+
+def register_collect_orphan_index():
+    @every("@every 1h")
+    def collect_orphan_index():
+        for record_type in SOCIAL_FEED_RECORD_TYPES:
+            for relation in ['friends', 'following']:
+                table_name = name_for_relation_index(
+                    prefix=SOCIAL_FEED_TABLE_PREFIX,
+                    relation=relation,
+                    record_type=record_type
+                )
+                while collect_orphan_index_chunk(table_name, record_type):
+                    pass
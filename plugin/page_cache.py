@@ -0,0 +1,176 @@
+import hashlib
+import importlib
+import json
+
+import sqlalchemy as sa
+
+from .cache import (
+    MISSING,
+    LRUCache,
+)
+from .feed import (
+    sql_for_relation_index_value,
+)
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_PAGE_CACHE_BACKEND,
+    SOCIAL_FEED_PAGE_CACHE_SIZE,
+    SOCIAL_FEED_PAGE_CACHE_TTL,
+    SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+from .table_name import (
+    name_for_feed_version_table,
+    name_for_pull_fanout_user_table,
+)
+
+MEMORY_PAGE_CACHE_BACKEND = 'memory'
+
+# Records of pull fanout users are never written to the readers' index, so
+# each pull fanout user has a version of their own which is part of the
+# version of every follower's feed.
+PULL_FANOUT_FEED_VERSION_KEY_PREFIX = 'pull_fanout:'
+
+
+def create_feed_page_cache():
+    if SOCIAL_FEED_PAGE_CACHE_BACKEND == MEMORY_PAGE_CACHE_BACKEND:
+        cache_class = LRUCache
+    else:
+        module_name, class_name = SOCIAL_FEED_PAGE_CACHE_BACKEND.split(':')
+        cache_class = getattr(
+            importlib.import_module(module_name),
+            class_name
+        )
+    return cache_class(
+        'feed_page',
+        maxsize=SOCIAL_FEED_PAGE_CACHE_SIZE,
+        ttl=SOCIAL_FEED_PAGE_CACHE_TTL
+    )
+
+
+feed_page_cache = create_feed_page_cache()
+
+
+def is_feed_page_cache_enabled():
+    return SOCIAL_FEED_PAGE_CACHE_SIZE > 0
+
+
+def sql_for_feed_version_bump(left_ids_sql):
+    return '''
+        INSERT INTO {db_name}.{feed_version_table} AS feed_version (
+            left_id,
+            version
+        )
+        SELECT DISTINCT reader.left_id, 1
+        FROM ({left_ids_sql}) reader
+        ORDER BY reader.left_id
+        ON CONFLICT (left_id) DO UPDATE
+        SET version = feed_version.version + 1
+    '''.format(
+        db_name=DB_NAME,
+        feed_version_table=name_for_feed_version_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        left_ids_sql=left_ids_sql
+    )
+
+
+def sql_for_versioned_index_change(change_sql):
+    if not is_feed_page_cache_enabled():
+        return change_sql
+
+    return '''
+        WITH changed_index AS (
+            {change_sql}
+            RETURNING {left_id} as left_id
+        )
+        {feed_version_bump_sql}
+    '''.format(
+        change_sql=change_sql,
+        left_id=sql_for_relation_index_value('left_id'),
+        feed_version_bump_sql=sql_for_feed_version_bump(
+            'SELECT left_id FROM changed_index'
+        )
+    )
+
+
+def bump_feed_versions(conn, user_ids):
+    if not is_feed_page_cache_enabled() or not user_ids:
+        return
+
+    bump_feed_versions_sql = sa.text(sql_for_feed_version_bump('''
+        SELECT u.id as left_id
+        FROM unnest(:user_ids ::text[]) AS u(id)
+    '''))
+    conn.execute(bump_feed_versions_sql, user_ids=list(user_ids))
+
+
+def pull_fanout_feed_version_key(user_id):
+    return PULL_FANOUT_FEED_VERSION_KEY_PREFIX + user_id
+
+
+def sql_for_followed_pull_fanout_version_keys():
+    if not SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD:
+        return ''
+
+    return '''
+        UNION ALL
+        SELECT :pull_fanout_key_prefix || f.right_id
+        FROM {db_name}._follow f
+        JOIN {db_name}.{pull_fanout_user_table} pull_fanout_user
+        ON pull_fanout_user.user_id = f.right_id
+        WHERE f.left_id = :user_id
+    '''.format(
+        db_name=DB_NAME,
+        pull_fanout_user_table=name_for_pull_fanout_user_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    )
+
+
+def get_feed_version(conn, user_id):
+    get_feed_version_sql = sa.text('''
+        SELECT version_key.left_id, coalesce(feed_version.version, 0)
+        FROM (
+            SELECT :user_id ::text AS left_id
+            {followed_pull_fanout_version_keys_sql}
+        ) version_key
+        LEFT JOIN {db_name}.{feed_version_table} feed_version
+        ON feed_version.left_id = version_key.left_id
+        ORDER BY version_key.left_id
+    '''.format(
+        db_name=DB_NAME,
+        feed_version_table=name_for_feed_version_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        followed_pull_fanout_version_keys_sql=(
+            sql_for_followed_pull_fanout_version_keys()
+        )
+    ))
+    return tuple(
+        (left_id, version) for left_id, version in conn.execute(
+            get_feed_version_sql,
+            user_id=user_id,
+            pull_fanout_key_prefix=PULL_FANOUT_FEED_VERSION_KEY_PREFIX
+        )
+    )
+
+
+def feed_page_cache_key(user_id, relations, record_type, query):
+    query_hash = hashlib.sha1(
+        json.dumps(query, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+    return (user_id, tuple(relations), record_type, query_hash)
+
+
+def get_cached_feed_page(key, version):
+    entry = feed_page_cache.get(key)
+    if entry is MISSING or entry[0] != version:
+        return MISSING
+    return entry[1]
+
+
+def set_cached_feed_page(key, version, result):
+    if 'error' in result:
+        return
+    feed_page_cache.set(key, (version, result))
@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+
+import sqlalchemy as sa
+
+from .database import (
+    get_engine,
+)
+from .options import (
+    SOCIAL_FEED_RECORD_TYPE_PARALLELISM,
+)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def is_record_type_parallelism_enabled():
+    return SOCIAL_FEED_RECORD_TYPE_PARALLELISM > 1
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=SOCIAL_FEED_RECORD_TYPE_PARALLELISM
+            )
+        return _executor
+
+
+def finish_record_type_transactions(transactions, commit):
+    try:
+        for _, transaction in transactions:
+            if commit:
+                transaction.commit()
+            else:
+                transaction.rollback()
+    finally:
+        for record_type_conn, _ in transactions:
+            try:
+                record_type_conn.close()
+            except Exception:
+                logger.exception('Failed to close record type connection')
+
+
+def defer_record_type_transactions(conn, transactions):
+    finished = []
+
+    def finish(commit):
+        if finished:
+            return
+        finished.append(commit)
+        finish_record_type_transactions(transactions, commit)
+
+    sa.event.listen(conn, 'commit', lambda _: finish(True))
+    sa.event.listen(conn, 'rollback', lambda _: finish(False))
+
+
+def run_for_record_types(conn, record_types, run):
+    if not is_record_type_parallelism_enabled() or len(record_types) <= 1:
+        for record_type in record_types:
+            run(conn, record_type)
+        return
+
+    # Every record type runs in a transaction of its own connection. They are
+    # rolled back together if any of them fails, otherwise they are committed
+    # when the caller's transaction commits, or rolled back with it.
+    transactions = []
+    transactions_lock = threading.Lock()
+
+    def run_in_transaction(record_type):
+        record_type_conn = get_engine().connect()
+        try:
+            transaction = record_type_conn.begin()
+        except Exception:
+            record_type_conn.close()
+            raise
+        with transactions_lock:
+            transactions.append((record_type_conn, transaction))
+        run(record_type_conn, record_type)
+
+    futures = [
+        get_executor().submit(run_in_transaction, record_type)
+        for record_type in record_types
+    ]
+    errors = [
+        future.exception() for future in futures
+        if future.exception() is not None
+    ]
+    if errors:
+        finish_record_type_transactions(transactions, commit=False)
+        raise errors[0]
+
+    if conn.in_transaction():
+        defer_record_type_transactions(conn, transactions)
+    else:
+        finish_record_type_transactions(transactions, commit=True)
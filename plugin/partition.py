@@ -0,0 +1,215 @@
+from datetime import (
+    date,
+    datetime,
+)
+
+from skygear import (
+    every,
+)
+from skygear.utils import db
+import sqlalchemy as sa
+
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_INDEX_PARTITIONS,
+    SOCIAL_FEED_INDEX_RETENTION_MONTHS,
+    SOCIAL_FEED_RECORD_TYPES,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+from .table_name import (
+    is_compact_index_storage,
+    name_for_relation_index,
+    name_for_table_partition,
+)
+
+PRECREATE_PARTITION_MONTHS = 2
+MONTH_PARTITION_SUFFIX_FORMAT = 'm%Y%m'
+MONTH_PARTITION_SUFFIX_LENGTH = len('m000000')
+
+
+def is_index_retention_enabled():
+    return (
+        is_compact_index_storage()
+        and SOCIAL_FEED_INDEX_RETENTION_MONTHS > 0
+    )
+
+
+def sql_for_relation_index_partition_by():
+    if is_index_retention_enabled():
+        return 'PARTITION BY RANGE (record_created_at)'
+    if SOCIAL_FEED_INDEX_PARTITIONS:
+        return 'PARTITION BY HASH (left_id)'
+    return ''
+
+
+def add_months(month, months):
+    year, month_index = divmod(month.year * 12 + month.month - 1 + months, 12)
+    return date(year, month_index + 1, 1)
+
+
+def current_month():
+    today = datetime.utcnow().date()
+    return date(today.year, today.month, 1)
+
+
+def get_partition_names(conn, table_name):
+    get_partitions_sql = sa.text('''
+        SELECT c.relname as name
+        FROM pg_catalog.pg_inherits i
+        JOIN pg_catalog.pg_class c ON c.oid = i.inhrelid
+        JOIN pg_catalog.pg_class p ON p.oid = i.inhparent
+        JOIN pg_catalog.pg_namespace n ON n.oid = p.relnamespace
+        WHERE n.nspname = :db_name
+        AND p.relname = :table_name
+    ''')
+    return [
+        partition.name for partition in conn.execute(
+            get_partitions_sql,
+            db_name=DB_NAME,
+            table_name=table_name
+        )
+    ]
+
+
+def has_partition_with_suffix(partition_names, partition_suffix):
+    # Partitions created before long names were hashed keep their old name,
+    # they are matched by suffix so they are not created a second time.
+    return any(
+        name.endswith('_' + partition_suffix) for name in partition_names
+    )
+
+
+def create_relation_index_hash_partitions(conn, table_name, parent_name,
+                                          partition_suffix_prefix=''):
+    partition_names = get_partition_names(conn, parent_name)
+    for remainder in range(SOCIAL_FEED_INDEX_PARTITIONS):
+        partition_suffix = '{0}p{1:d}'.format(
+            partition_suffix_prefix,
+            remainder
+        )
+        if has_partition_with_suffix(partition_names, partition_suffix):
+            continue
+
+        create_partition_sql = sa.text('''
+            CREATE TABLE IF NOT EXISTS {db_name}.{partition_name}
+            PARTITION OF {db_name}.{parent_name}
+            FOR VALUES WITH (MODULUS {modulus:d}, REMAINDER {remainder:d})
+            WITH (fillfactor = 100)
+        '''.format(
+            db_name=DB_NAME,
+            parent_name=parent_name,
+            partition_name=name_for_table_partition(
+                table_name,
+                partition_suffix
+            ),
+            modulus=SOCIAL_FEED_INDEX_PARTITIONS,
+            remainder=remainder
+        ))
+        conn.execute(create_partition_sql)
+
+
+def create_relation_index_month_partition(conn, table_name, month):
+    partition_suffix = month.strftime(MONTH_PARTITION_SUFFIX_FORMAT)
+    if has_partition_with_suffix(
+        get_partition_names(conn, table_name),
+        partition_suffix
+    ):
+        return
+
+    partition_name = name_for_table_partition(table_name, partition_suffix)
+    partition_sql = 'WITH (fillfactor = 100)'
+    if SOCIAL_FEED_INDEX_PARTITIONS:
+        partition_sql = 'PARTITION BY HASH (left_id)'
+
+    create_partition_sql = sa.text('''
+        CREATE TABLE IF NOT EXISTS {db_name}.{partition_name}
+        PARTITION OF {db_name}.{table_name}
+        FOR VALUES FROM ('{month_start}') TO ('{month_end}')
+        {partition_sql}
+    '''.format(
+        db_name=DB_NAME,
+        table_name=table_name,
+        partition_name=partition_name,
+        month_start=month.isoformat(),
+        month_end=add_months(month, 1).isoformat(),
+        partition_sql=partition_sql
+    ))
+    conn.execute(create_partition_sql)
+
+    if SOCIAL_FEED_INDEX_PARTITIONS:
+        create_relation_index_hash_partitions(
+            conn,
+            table_name=table_name,
+            parent_name=partition_name,
+            partition_suffix_prefix=partition_suffix + '_'
+        )
+
+
+def create_relation_index_partitions(conn, table_name):
+    if is_index_retention_enabled():
+        this_month = current_month()
+        for months in range(-SOCIAL_FEED_INDEX_RETENTION_MONTHS,
+                            PRECREATE_PARTITION_MONTHS + 1):
+            create_relation_index_month_partition(
+                conn,
+                table_name,
+                add_months(this_month, months)
+            )
+    elif SOCIAL_FEED_INDEX_PARTITIONS:
+        create_relation_index_hash_partitions(
+            conn,
+            table_name=table_name,
+            parent_name=table_name
+        )
+
+
+def drop_expired_relation_index_partitions(conn, table_name):
+    partition_names = get_partition_names(conn, table_name)
+
+    retention_start = add_months(
+        current_month(),
+        -SOCIAL_FEED_INDEX_RETENTION_MONTHS
+    )
+    for partition_name in partition_names:
+        try:
+            partition_month = datetime.strptime(
+                partition_name[-MONTH_PARTITION_SUFFIX_LENGTH:],
+                MONTH_PARTITION_SUFFIX_FORMAT
+            ).date()
+        except ValueError:
+            continue
+        if partition_month >= retention_start:
+            continue
+
+        detach_partition_sql = sa.text('''
+            ALTER TABLE {db_name}.{table_name}
+            DETACH PARTITION {db_name}.{partition_name}
+        '''.format(
+            db_name=DB_NAME,
+            table_name=table_name,
+            partition_name=partition_name
+        ))
+        conn.execute(detach_partition_sql)
+
+        drop_partition_sql = sa.text('''
+            DROP TABLE {db_name}.{partition_name}
+        '''.format(db_name=DB_NAME, partition_name=partition_name))
+        conn.execute(drop_partition_sql)
+
+
+def register_maintain_relation_index_partitions():
+    @every("@every 24h")
+    def maintain_relation_index_partitions():
+        if not is_index_retention_enabled():
+            return
+
+        for record_type in SOCIAL_FEED_RECORD_TYPES:
+            for relation in ['friends', 'following']:
+                table_name = name_for_relation_index(
+                    prefix=SOCIAL_FEED_TABLE_PREFIX,
+                    relation=relation,
+                    record_type=record_type
+                )
+                with db.conn() as conn:
+                    create_relation_index_partitions(conn, table_name)
+                    drop_expired_relation_index_partitions(conn, table_name)
@@ -1,4 +1,5 @@
 import copy
+import re
 
 
 def generate_skygear_query_from_indexed_ids(query, records_ids):
@@ -27,3 +28,177 @@ def generate_skygear_query_from_indexed_ids(query, records_ids):
             records_ids
         ]
     return query_clone
+
+
+def generate_skygear_query_from_indexed_page(query, records_ids):
+    query_clone = generate_skygear_query_from_indexed_ids(query, records_ids)
+    query_clone['sort'] = [
+        [
+            {
+                '$type': 'keypath',
+                '$val': '_created_at'
+            },
+            'desc'
+        ],
+        [
+            {
+                '$type': 'keypath',
+                '$val': '_id'
+            },
+            'desc'
+        ],
+    ]
+    query_clone['limit'] = len(records_ids)
+    query_clone.pop('offset', None)
+    return query_clone
+
+
+class SkygearQueryNotSupported(Exception):
+    pass
+
+
+SQL_COMPARISON_OPERATORS = {
+    'eq': '=',
+    'neq': '<>',
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+    'like': 'LIKE',
+    'ilike': 'ILIKE',
+}
+
+SQL_SORT_ORDERS = {
+    'asc': 'ASC',
+    'desc': 'DESC',
+}
+
+RESERVED_KEYPATH_COLUMNS = {
+    '_id': '_id',
+    '_owner': '_owner_id',
+    '_ownerID': '_owner_id',
+    '_created_at': '_created_at',
+    '_created_by': '_created_by',
+    '_updated_at': '_updated_at',
+    '_updated_by': '_updated_by',
+}
+
+SQL_COLUMN_NAME_PATTERN = re.compile(r'^[A-Za-z][A-Za-z0-9_]*$')
+
+
+def generate_sql_column_from_keypath(keypath, table_alias):
+    if not isinstance(keypath, dict) or keypath.get('$type') != 'keypath':
+        raise SkygearQueryNotSupported('Expect a keypath')
+
+    key = keypath['$val']
+    if key in RESERVED_KEYPATH_COLUMNS:
+        column = RESERVED_KEYPATH_COLUMNS[key]
+    elif SQL_COLUMN_NAME_PATTERN.match(key):
+        column = key
+    else:
+        raise SkygearQueryNotSupported('Unsupported keypath: ' + key)
+
+    return '{table_alias}."{column}"'.format(
+        table_alias=table_alias,
+        column=column
+    )
+
+
+def generate_sql_value_from_skygear_value(value):
+    if not isinstance(value, dict):
+        if isinstance(value, list):
+            raise SkygearQueryNotSupported('Unexpected array value')
+        return value
+
+    value_type = value.get('$type')
+    if value_type == 'date':
+        return value['$date']
+    if value_type == 'ref':
+        if '$recordID' in value:
+            return value['$recordID']
+        return value['$id'].split('/', 1)[-1]
+
+    raise SkygearQueryNotSupported(
+        'Unsupported value type: ' + str(value_type)
+    )
+
+
+def bind_sql_param(params, value):
+    param_name = 'skygear_query_param_{0}'.format(len(params))
+    params[param_name] = value
+    return ':' + param_name
+
+
+def generate_sql_predicate_from_skygear_predicate(predicate, table_alias,
+                                                  params):
+    operator = predicate[0]
+    operands = predicate[1:]
+
+    if operator in ('and', 'or'):
+        if not operands:
+            raise SkygearQueryNotSupported('Empty compound predicate')
+        sql_operands = [
+            generate_sql_predicate_from_skygear_predicate(
+                operand,
+                table_alias,
+                params
+            )
+            for operand in operands
+        ]
+        joiner = ' {0} '.format(operator.upper())
+        return '(' + joiner.join(sql_operands) + ')'
+
+    if operator == 'not':
+        return '(NOT {0})'.format(
+            generate_sql_predicate_from_skygear_predicate(
+                operands[0],
+                table_alias,
+                params
+            )
+        )
+
+    if operator == 'in':
+        column = generate_sql_column_from_keypath(operands[0], table_alias)
+        if not isinstance(operands[1], list):
+            raise SkygearQueryNotSupported('Expect an array for in')
+        values = tuple(
+            generate_sql_value_from_skygear_value(value)
+            for value in operands[1]
+        )
+        if not values:
+            return 'FALSE'
+        return '{column} IN {values}'.format(
+            column=column,
+            values=bind_sql_param(params, values)
+        )
+
+    if operator in SQL_COMPARISON_OPERATORS:
+        column = generate_sql_column_from_keypath(operands[0], table_alias)
+        value = generate_sql_value_from_skygear_value(operands[1])
+        if value is None and operator == 'eq':
+            return '{column} IS NULL'.format(column=column)
+        if value is None and operator == 'neq':
+            return '{column} IS NOT NULL'.format(column=column)
+        return '{column} {operator} {value}'.format(
+            column=column,
+            operator=SQL_COMPARISON_OPERATORS[operator],
+            value=bind_sql_param(params, value)
+        )
+
+    raise SkygearQueryNotSupported('Unsupported predicate: ' + str(operator))
+
+
+def generate_sql_order_by_from_skygear_sort(sort, table_alias):
+    order_by = []
+    for sort_descriptor in sort:
+        column = generate_sql_column_from_keypath(
+            sort_descriptor[0],
+            table_alias
+        )
+        if sort_descriptor[1] not in SQL_SORT_ORDERS:
+            raise SkygearQueryNotSupported('Unsupported sort order')
+        order_by.append('{column} {order}'.format(
+            column=column,
+            order=SQL_SORT_ORDERS[sort_descriptor[1]]
+        ))
+    return order_by
@@ -1,234 +1,728 @@
+from collections import (
+    OrderedDict,
+    namedtuple,
+)
+
 import skygear
 from skygear import (
+    after_delete,
     after_save,
     op,
 )
-from skygear.container import SkygearContainer
 from skygear.options import options
 from skygear.utils import db
 import sqlalchemy as sa
 
+from .backfill import (
+    backfill_feed,
+)
+
+from .cache import (
+    MISSING,
+)
+
+from .container import (
+    get_container,
+)
+
+from .fanout import (
+    FanoutBuffer,
+)
+
+from .feed import (
+    cursor_for_feed_page,
+    feed_page_cursor,
+    feed_page_limit,
+    fetch_feed_page,
+    fetch_feed_records_ids,
+    sql_for_relation_index_id,
+    sql_for_relation_index_insert,
+    sql_for_relations_feed_sources,
+    sql_for_relation_index_value,
+)
+
 from .options import (
     DB_NAME,
-    SOCIAL_FEED_TABLE_PREFIX,
+    SOCIAL_FEED_FANOUT_BATCH_SIZE,
+    SOCIAL_FEED_FANOUT_BATCH_WINDOW,
     SOCIAL_FEED_FANOUT_POLICY,
+    SOCIAL_FEED_QUERY_ENGINE,
+    SOCIAL_FEED_QUERY_PAGE_SIZE,
+    SOCIAL_FEED_RECORD_TYPES,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+
+from .page_cache import (
+    bump_feed_versions,
+    feed_page_cache_key,
+    get_cached_feed_page,
+    get_feed_version,
+    is_feed_page_cache_enabled,
+    pull_fanout_feed_version_key,
+    set_cached_feed_page,
+    sql_for_feed_version_bump,
+    sql_for_versioned_index_change,
 )
 
 from .query import (
+    SkygearQueryNotSupported,
     generate_skygear_query_from_indexed_ids,
+    generate_skygear_query_from_indexed_page,
+)
+
+from .sql_query import (
+    SQL_QUERY_ENGINE,
+    query_feed_records_by_sql,
 )
 
 from .table_name import (
     name_for_followings_relation_index,
-    name_for_friends_relation_index
+    name_for_friends_relation_index,
+    name_for_mutual_friend_table,
+    name_for_relation_index,
+)
+
+from .trim import (
+    is_feed_length_cap_enabled,
+    sql_for_feed_length_increment,
 )
 
 from .user import (
-    should_record_be_indexed,
+    get_pull_fanout_user_ids,
+    get_users_fanout_policy,
+    is_relation_enabled,
 )
 
+from .work_queue import (
+    enqueue_task,
+    is_work_queue_enabled,
+    task,
+)
 
-def register_query_my_friends_records():
-    @op('social_feed:query_my_friends_records', user_required=True)
-    def social_feed_query_my_friends_records(serializedSkygearQuery):
-        with db.conn() as conn:
-            query_record_type = serializedSkygearQuery['record_type']
-            table_name = name_for_friends_relation_index(
-                prefix=SOCIAL_FEED_TABLE_PREFIX,
-                record_type=query_record_type
-            )
-            my_user_id = skygear.utils.context.current_user_id()
-            get_my_friends_records_ids_sql = sa.text('''
-                SELECT record_ref as id
-                FROM {db_name}.{table_name}
-                WHERE left_id = :my_user_id
-            '''.format(db_name=DB_NAME, table_name=table_name))
-            results = conn.execute(
-                get_my_friends_records_ids_sql,
-                my_user_id=my_user_id
+NewRecord = namedtuple('NewRecord', ['id', 'owner_id', 'created_at'])
+
+
+def backfill_before_cursor(conn, relations, record_types, user_id, cursor,
+                           limit):
+    before = None
+    if cursor is not None:
+        before = cursor['created_at']
+    return backfill_feed(
+        conn,
+        relations=relations,
+        record_types=record_types,
+        user_id=user_id,
+        before=before,
+        limit=limit
+    )
+
+
+def fetch_backfilled_feed_page(conn, relations, record_types, user_id, after,
+                               limit):
+    feed_sources = sql_for_relations_feed_sources(
+        relations,
+        record_types,
+        after=after,
+        limit_sql=':limit'
+    )
+    page = fetch_feed_page(
+        conn,
+        feed_sources=feed_sources,
+        user_id=user_id,
+        after=after,
+        limit=limit
+    )
+    # Records older than the backfill window are indexed once the reader
+    # pages down to them, then the page is read again with them included.
+    if backfill_before_cursor(
+        conn,
+        relations,
+        record_types,
+        user_id,
+        cursor_for_feed_page(page, limit),
+        limit
+    ):
+        page = fetch_feed_page(
+            conn,
+            feed_sources=feed_sources,
+            user_id=user_id,
+            after=after,
+            limit=limit
+        )
+    return page
+
+
+def query_with_feed_page_cache(relations, record_type, query, fetch_result):
+    if not is_feed_page_cache_enabled():
+        return fetch_result()
+
+    my_user_id = skygear.utils.context.current_user_id()
+    cache_key = feed_page_cache_key(my_user_id, relations, record_type, query)
+    with db.conn() as conn:
+        feed_version = get_feed_version(conn, my_user_id)
+    result = get_cached_feed_page(cache_key, feed_version)
+    if result is not MISSING:
+        return result
+
+    result = fetch_result()
+    set_cached_feed_page(cache_key, feed_version, result)
+    return result
+
+
+def query_my_relation_records(relations, serializedSkygearQuery, after,
+                              limit):
+    after = feed_page_cursor(after)
+    limit = feed_page_limit(limit)
+    return query_with_feed_page_cache(
+        relations,
+        serializedSkygearQuery['record_type'],
+        {
+            'query': serializedSkygearQuery,
+            'after': after,
+            'limit': limit,
+        },
+        lambda: fetch_my_relation_records(
+            relations,
+            serializedSkygearQuery,
+            after=after,
+            limit=limit
+        )
+    )
+
+
+def fetch_my_relation_records(relations, serializedSkygearQuery, after,
+                              limit):
+    with db.conn() as conn:
+        query_record_type = serializedSkygearQuery['record_type']
+        feed_sources = sql_for_relations_feed_sources(
+            relations,
+            [query_record_type]
+        )
+        my_user_id = skygear.utils.context.current_user_id()
+
+        if after is not None and limit is None:
+            limit = SOCIAL_FEED_QUERY_PAGE_SIZE
+
+        if limit is None:
+            backfill_feed(
+                conn,
+                relations=relations,
+                record_types=[query_record_type],
+                user_id=my_user_id,
+                before=None,
+                limit=None
             )
 
-            records_ids = [record.id for record in results]
+        if SOCIAL_FEED_QUERY_ENGINE == SQL_QUERY_ENGINE:
+            sql_query = {
+                'feed_sources': feed_sources,
+                'user_id': my_user_id,
+                'serializedSkygearQuery': serializedSkygearQuery,
+                'after': after,
+                'limit': limit,
+            }
+            try:
+                result = query_feed_records_by_sql(conn, **sql_query)
+                if limit is not None and backfill_before_cursor(
+                    conn,
+                    relations,
+                    [query_record_type],
+                    my_user_id,
+                    result['cursor'],
+                    limit
+                ):
+                    result = query_feed_records_by_sql(conn, **sql_query)
+                return result
+            except SkygearQueryNotSupported:
+                pass
 
+        container = get_container(options.apikey)
+        if limit is None:
+            records_ids = fetch_feed_records_ids(
+                conn,
+                feed_sources=feed_sources,
+                user_id=my_user_id
+            )
             query = generate_skygear_query_from_indexed_ids(
                 serializedSkygearQuery,
                 records_ids
             )
-
-            container = SkygearContainer(api_key=options.apikey)
             return container.send_action(
                 'record:query',
                 query
             )
 
+        page = fetch_backfilled_feed_page(
+            conn,
+            relations=relations,
+            record_types=[query_record_type],
+            user_id=my_user_id,
+            after=after,
+            limit=limit
+        )
+        cursor = cursor_for_feed_page(page, limit)
+        if not page:
+            return {
+                'result': [],
+                'cursor': cursor,
+            }
+
+        query = generate_skygear_query_from_indexed_page(
+            serializedSkygearQuery,
+            [record.id for record in page]
+        )
+        result = container.send_action(
+            'record:query',
+            query
+        )
+        result['cursor'] = cursor
+        return result
+
+
+def register_query_my_friends_records():
+    @op('social_feed:query_my_friends_records', user_required=True)
+    def social_feed_query_my_friends_records(serializedSkygearQuery,
+                                             after=None, limit=None):
+        return query_my_relation_records(
+            ['friends'],
+            serializedSkygearQuery,
+            after=after,
+            limit=limit
+        )
+
 
 def register_query_my_followees_records():
     @op('social_feed:query_my_followees_records', user_required=True)
-    def query_my_followees_records(serializedSkygearQuery):
-        with db.conn() as conn:
-            query_record_type = serializedSkygearQuery['record_type']
-            table_name = name_for_followings_relation_index(
-                prefix=SOCIAL_FEED_TABLE_PREFIX,
-                record_type=query_record_type
-            )
-            my_user_id = skygear.utils.context.current_user_id()
-            get_my_followees_records_ids_sql = sa.text('''
-                SELECT record_ref as id
-                FROM {db_name}.{table_name}
-                WHERE left_id = :my_user_id
-            '''.format(db_name=DB_NAME, table_name=table_name))
-            results = conn.execute(
-                get_my_followees_records_ids_sql,
-                my_user_id=my_user_id
+    def query_my_followees_records(serializedSkygearQuery,
+                                   after=None, limit=None):
+        return query_my_relation_records(
+            ['following'],
+            serializedSkygearQuery,
+            after=after,
+            limit=limit
+        )
+
+
+def register_query_my_home_records():
+    @op('social_feed:query_my_home_records', user_required=True)
+    def query_my_home_records(serializedSkygearQuery, after=None, limit=None):
+        return query_my_relation_records(
+            ['friends', 'following'],
+            serializedSkygearQuery,
+            after=after,
+            limit=(
+                SOCIAL_FEED_QUERY_PAGE_SIZE if limit is None else limit
             )
+        )
 
-            records_ids = [record.id for record in results]
 
-            query = generate_skygear_query_from_indexed_ids(
-                serializedSkygearQuery,
-                records_ids
+def fetch_feed_page_records(container, page):
+    records_ids_by_type = OrderedDict()
+    for indexed_record in page:
+        records_ids_by_type.setdefault(
+            indexed_record.record_type,
+            []
+        ).append(indexed_record.id)
+
+    records_by_id = {}
+    for record_type, records_ids in records_ids_by_type.items():
+        query = generate_skygear_query_from_indexed_page(
+            {'record_type': record_type},
+            records_ids
+        )
+        result = container.send_action('record:query', query)
+        if 'error' in result:
+            return result
+        for record in result['result']:
+            records_by_id[record['_id']] = record
+
+    records = []
+    for indexed_record in page:
+        record_id = '{0}/{1}'.format(
+            indexed_record.record_type,
+            indexed_record.id
+        )
+        if record_id in records_by_id:
+            records.append(records_by_id[record_id])
+
+    return {
+        'result': records,
+    }
+
+
+def query_my_relations_timeline(relations, after, limit):
+    after = feed_page_cursor(after)
+    limit = feed_page_limit(limit)
+    return query_with_feed_page_cache(
+        relations,
+        None,
+        {
+            'after': after,
+            'limit': limit,
+        },
+        lambda: fetch_my_relations_timeline(relations, after, limit)
+    )
+
+
+def fetch_my_relations_timeline(relations, after, limit):
+    if limit is None:
+        limit = SOCIAL_FEED_QUERY_PAGE_SIZE
+
+    with db.conn() as conn:
+        if not relations or not SOCIAL_FEED_RECORD_TYPES:
+            return {
+                'result': [],
+                'cursor': None,
+            }
+
+        my_user_id = skygear.utils.context.current_user_id()
+        page = fetch_backfilled_feed_page(
+            conn,
+            relations=relations,
+            record_types=SOCIAL_FEED_RECORD_TYPES,
+            user_id=my_user_id,
+            after=after,
+            limit=limit
+        )
+
+    container = get_container(options.apikey)
+    result = fetch_feed_page_records(container, page)
+    if 'error' not in result:
+        result['cursor'] = cursor_for_feed_page(page, limit)
+    return result
+
+
+def register_query_my_friends_timeline():
+    @op('social_feed:query_my_friends_timeline', user_required=True)
+    def query_my_friends_timeline(after=None, limit=None):
+        return query_my_relations_timeline(
+            ['friends'],
+            after=after,
+            limit=limit
+        )
+
+
+def register_query_my_followees_timeline():
+    @op('social_feed:query_my_followees_timeline', user_required=True)
+    def query_my_followees_timeline(after=None, limit=None):
+        return query_my_relations_timeline(
+            ['following'],
+            after=after,
+            limit=limit
+        )
+
+
+def register_query_my_home_timeline():
+    @op('social_feed:query_my_home_timeline', user_required=True)
+    def query_my_home_timeline(after=None, limit=None):
+        return query_my_relations_timeline(
+            ['friends', 'following'],
+            after=after,
+            limit=limit
+        )
+
+
+def fanout_records(conn, record_type, records):
+    friends_table_name = name_for_friends_relation_index(
+        prefix=SOCIAL_FEED_TABLE_PREFIX,
+        record_type=record_type
+    )
+    followings_table_name = name_for_followings_relation_index(
+        prefix=SOCIAL_FEED_TABLE_PREFIX,
+        record_type=record_type
+    )
+
+    fanout_policies = get_users_fanout_policy(
+        DB_NAME,
+        conn,
+        [record.owner_id for record in records]
+    )
+    fanout_to_friends = [
+        is_relation_enabled(
+            fanout_policies[record.owner_id],
+            SOCIAL_FEED_FANOUT_POLICY,
+            'friends'
+        )
+        for record in records
+    ]
+    pull_fanout_user_ids = get_pull_fanout_user_ids(
+        DB_NAME,
+        conn,
+        [record.owner_id for record in records]
+    )
+    fanout_to_followers = [
+        is_relation_enabled(
+            fanout_policies[record.owner_id],
+            SOCIAL_FEED_FANOUT_POLICY,
+            'following'
+        ) and record.owner_id not in pull_fanout_user_ids
+        for record in records
+    ]
+    if not any(fanout_to_friends) and not any(fanout_to_followers):
+        return
+
+    new_friends_index_sql = '''
+        SELECT
+            m.right_id as left_id,
+            new_record.owner_id as right_id,
+            new_record.id as record_ref,
+            new_record.created_at as record_created_at
+        FROM new_record
+        JOIN {db_name}.{mutual_friend_table} m
+        ON m.left_id = new_record.owner_id
+        WHERE new_record.fanout_to_friends
+    '''.format(
+        db_name=DB_NAME,
+        mutual_friend_table=name_for_mutual_friend_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    )
+    new_followings_index_sql = '''
+        SELECT
+            f.left_id as left_id,
+            new_record.owner_id as right_id,
+            new_record.id as record_ref,
+            new_record.created_at as record_created_at
+        FROM new_record
+        JOIN {db_name}._follow f
+        ON f.right_id = new_record.owner_id
+        WHERE new_record.fanout_to_followers
+    '''.format(db_name=DB_NAME)
+
+    returning_sql = ''
+    if is_feed_length_cap_enabled() or is_feed_page_cache_enabled():
+        returning_sql = 'RETURNING {0} as left_id'.format(
+            sql_for_relation_index_value('left_id')
+        )
+    friends_fanout_sql = sql_for_relation_index_insert(
+        friends_table_name,
+        new_friends_index_sql,
+        returning_sql=returning_sql
+    )
+    followings_fanout_sql = sql_for_relation_index_insert(
+        followings_table_name,
+        new_followings_index_sql,
+        returning_sql=returning_sql
+    )
+    fanout_followup_sqls = []
+    if is_feed_length_cap_enabled():
+        fanout_followup_sqls.append(sql_for_feed_length_increment([
+            (friends_table_name, 'friends_fanout'),
+            (followings_table_name, 'followings_fanout'),
+        ]))
+    if is_feed_page_cache_enabled():
+        fanout_followup_sqls.append(sql_for_feed_version_bump('''
+            SELECT left_id FROM friends_fanout
+            UNION ALL
+            SELECT left_id FROM followings_fanout
+        '''))
+    if fanout_followup_sqls:
+        followings_fanout_sql = '''
+            , followings_fanout AS (
+                {followings_fanout_sql}
             )
+            {fanout_followup_ctes}
+            {fanout_followup_sql}
+        '''.format(
+            followings_fanout_sql=followings_fanout_sql,
+            fanout_followup_ctes=''.join(
+                ', fanout_followup_{0:d} AS ({1})'.format(i, followup_sql)
+                for i, followup_sql in enumerate(fanout_followup_sqls[:-1])
+            ),
+            fanout_followup_sql=fanout_followup_sqls[-1]
+        )
 
-            container = SkygearContainer(api_key=options.apikey)
-            return container.send_action(
-                'record:query',
-                query
+    create_index_sql = sa.text('''
+        WITH new_record AS (
+            SELECT *
+            FROM unnest(
+                :record_ids ::text[],
+                :record_owner_ids ::text[],
+                :record_created_ats ::timestamp without time zone[],
+                :fanout_to_friends ::boolean[],
+                :fanout_to_followers ::boolean[]
+            ) AS r(
+                id,
+                owner_id,
+                created_at,
+                fanout_to_friends,
+                fanout_to_followers
             )
+        ), friends_fanout AS (
+            {friends_fanout_sql}
+        )
+        {followings_fanout_sql}
+    '''.format(
+        friends_fanout_sql=friends_fanout_sql,
+        followings_fanout_sql=followings_fanout_sql
+    ))
 
+    conn.execute(
+        create_index_sql,
+        record_ids=[record.id for record in records],
+        record_owner_ids=[record.owner_id for record in records],
+        record_created_ats=[record.created_at for record in records],
+        fanout_to_friends=fanout_to_friends,
+        fanout_to_followers=fanout_to_followers
+    )
 
-def register_after_save_add_record_to_index_for_friends(record_type):
-    @after_save(record_type, async=True)
-    def after_save_add_record_to_index_for_friends(record, original_record,
-                                                   db):
-        if original_record is not None:
-            return
+    bump_feed_versions(conn, set(
+        pull_fanout_feed_version_key(record.owner_id)
+        for record in records
+        if record.owner_id in pull_fanout_user_ids
+    ))
 
-        record_id = record.id.key
-        record_owner_id = record.owner_id
 
-        should_index = should_record_be_indexed(
-            DB_NAME,
-            SOCIAL_FEED_FANOUT_POLICY,
-            db,
-            user_id=record_owner_id,
-            relation='friends'
+def enqueue_fanout_records(conn, record_type, records):
+    enqueue_task(conn, 'social_feed:fanout_records', {
+        'record_type': record_type,
+        'records': [
+            {
+                'id': record.id,
+                'owner_id': record.owner_id,
+                'created_at': record.created_at.isoformat(),
+            }
+            for record in records
+        ],
+    })
+
+
+def register_fanout_records_task():
+    @task('social_feed:fanout_records')
+    def fanout_records_task(conn, payload):
+        fanout_records(
+            conn,
+            payload['record_type'],
+            [NewRecord(**record) for record in payload['records']]
         )
-        if not should_index:
-            return
 
-        table_name = name_for_friends_relation_index(
+
+def bump_feed_versions_for_updated_record(conn, record_type, record):
+    for relation in ['friends', 'following']:
+        table_name = name_for_relation_index(
             prefix=SOCIAL_FEED_TABLE_PREFIX,
+            relation=relation,
             record_type=record_type
         )
-
-        create_index_sql = sa.text('''
-            INSERT INTO {db_name}.{table_name} (
-                _id,
-                _database_id,
-                _owner_id,
-                _created_at,
-                _created_by,
-                _updated_at,
-                _updated_by,
-                _access,
-                left_id,
-                right_id,
-                record_ref
-            )
-            SELECT
-                uuid_generate_v4() as _id,
-                '' as _database_id,
-                f1.left_id as _owner_id,
-                current_timestamp as _created_at,
-                f1.left_id as _created_by,
-                current_timestamp as _updated_at,
-                f1.left_id as _created_by,
-                '[]'::jsonb as _access,
-                f1.left_id as left_id,
-                :record_owner_id as right_id,
-                :record_id as record_ref
-            FROM {db_name}._friend f1
-            JOIN {db_name}._friend f2
-            ON f1.right_id = f2.left_id
-            WHERE f1.right_id = :record_owner_id
-            AND f2.left_id = :record_owner_id
-            AND f1.left_id = f2.right_id
+        bump_readers_feed_versions_sql = sa.text(sql_for_feed_version_bump('''
+            SELECT {left_id} as left_id
+            FROM {db_name}.{table_name}
+            WHERE record_ref = {record_ref}
         '''.format(
             db_name=DB_NAME,
             table_name=table_name,
-            record_type=record_type
-        ))
+            left_id=sql_for_relation_index_value('left_id'),
+            record_ref=sql_for_relation_index_id(':record_id')
+        )))
+        conn.execute(bump_readers_feed_versions_sql, record_id=record.id.key)
 
-        db.execute(
-            create_index_sql,
-            record_owner_id=record_owner_id,
-            record_id=record_id
+    bump_feed_versions(conn, [
+        pull_fanout_feed_version_key(user_id)
+        for user_id in get_pull_fanout_user_ids(
+            DB_NAME,
+            conn,
+            [record.owner_id]
         )
+    ])
+
 
-    return after_save_add_record_to_index_for_friends
+def register_after_save_add_record_to_index(record_type):
+    def add_records_to_index(conn, records):
+        if is_work_queue_enabled():
+            enqueue_fanout_records(conn, record_type, records)
+        else:
+            fanout_records(conn, record_type, records)
 
+    def flush_records(records):
+        with db.conn() as conn:
+            add_records_to_index(conn, records)
+
+    fanout_buffer = FanoutBuffer(
+        flush_records,
+        batch_size=SOCIAL_FEED_FANOUT_BATCH_SIZE,
+        batch_window=SOCIAL_FEED_FANOUT_BATCH_WINDOW
+    )
 
-def register_after_save_add_record_to_index_for_followers(record_type):
     @after_save(record_type, async=True)
-    def after_save_add_record_to_index_for_followers(record, original_record,
-                                                     db):
+    def after_save_add_record_to_index(record, original_record, db):
         if original_record is not None:
+            # Cached feed pages embed the record, so its readers' versions
+            # are bumped when it is edited.
+            if is_feed_page_cache_enabled():
+                bump_feed_versions_for_updated_record(db, record_type, record)
             return
 
-        record_id = record.id.key
-        record_owner_id = record.owner_id
-
-        should_index = should_record_be_indexed(
-            DB_NAME,
-            SOCIAL_FEED_FANOUT_POLICY,
-            db,
-            user_id=record_owner_id,
-            relation='following'
+        new_record = NewRecord(
+            id=record.id.key,
+            owner_id=record.owner_id,
+            created_at=record.created_at
         )
-        if not should_index:
+        if SOCIAL_FEED_FANOUT_BATCH_SIZE > 1:
+            fanout_buffer.add(new_record)
             return
 
-        table_name = name_for_followings_relation_index(
+        add_records_to_index(db, [new_record])
+
+    return after_save_add_record_to_index
+
+
+def remove_records_from_index(conn, record_type, record_ids):
+    for relation in ['friends', 'following']:
+        table_name = name_for_relation_index(
             prefix=SOCIAL_FEED_TABLE_PREFIX,
+            relation=relation,
             record_type=record_type
         )
-
-        create_index_sql = sa.text('''
-            INSERT INTO {db_name}.{table_name} (
-                _id,
-                _database_id,
-                _owner_id,
-                _created_at,
-                _created_by,
-                _updated_at,
-                _updated_by,
-                _access,
-                left_id,
-                right_id,
-                record_ref
+        remove_records_sql = sa.text(sql_for_versioned_index_change('''
+            DELETE FROM {db_name}.{table_name}
+            WHERE record_ref IN (
+                SELECT {record_ref}
+                FROM unnest(:record_ids ::text[]) AS deleted_record(id)
             )
-            SELECT
-                uuid_generate_v4() as _id,
-                '' as _database_id,
-                f.left_id as _owner_id,
-                current_timestamp as _created_at,
-                f.left_id as _created_by,
-                current_timestamp as _updated_at,
-                f.left_id as _created_by,
-                '[]'::jsonb as _access,
-                f.left_id as left_id,
-                :record_owner_id as right_id,
-                :record_id as record_ref
-            FROM {db_name}._follow f
-            WHERE f.right_id = :record_owner_id
         '''.format(
             db_name=DB_NAME,
             table_name=table_name,
-            record_type=record_type
-        ))
+            record_ref=sql_for_relation_index_id('deleted_record.id')
+        )))
+        conn.execute(remove_records_sql, record_ids=record_ids)
 
-        db.execute(
-            create_index_sql,
-            record_owner_id=record_owner_id,
-            record_id=record_id
+
+def register_remove_records_from_index_task():
+    @task('social_feed:remove_records_from_index')
+    def remove_records_from_index_task(conn, payload):
+        remove_records_from_index(
+            conn,
+            payload['record_type'],
+            payload['record_ids']
         )
+
+
+def register_after_delete_remove_record_from_index(record_type):
+    def remove_from_index(conn, record_ids):
+        if is_work_queue_enabled():
+            enqueue_task(conn, 'social_feed:remove_records_from_index', {
+                'record_type': record_type,
+                'record_ids': record_ids,
+            })
+        else:
+            remove_records_from_index(conn, record_type, record_ids)
+
+    def flush_record_ids(record_ids):
+        with db.conn() as conn:
+            remove_from_index(conn, record_ids)
+
+    delete_buffer = FanoutBuffer(
+        flush_record_ids,
+        batch_size=SOCIAL_FEED_FANOUT_BATCH_SIZE,
+        batch_window=SOCIAL_FEED_FANOUT_BATCH_WINDOW
+    )
+
+    @after_delete(record_type, async=True)
+    def after_delete_remove_record_from_index(record, db):
+        if SOCIAL_FEED_FANOUT_BATCH_SIZE > 1:
+            delete_buffer.add(record.id.key)
+            return
+
+        remove_from_index(db, [record.id.key])
+
+    return after_delete_remove_record_from_index
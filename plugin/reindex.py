@@ -0,0 +1,408 @@
+import logging
+
+import skygear
+from skygear import (
+    every,
+    op,
+)
+from skygear.utils import db
+import sqlalchemy as sa
+
+from .backfill import (
+    sql_for_backfill_insert,
+)
+from .feed import (
+    sql_for_pull_fanout_user_exclusion,
+    sql_for_relation_index_id,
+)
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_RECORD_TYPES,
+    SOCIAL_FEED_REINDEX_CHUNK_SIZE,
+    SOCIAL_FEED_TABLE_PREFIX,
+    SOCIAL_FEED_WORK_QUEUE_MAX_ATTEMPTS,
+)
+from .page_cache import (
+    bump_feed_versions,
+)
+from .parallel import (
+    run_for_record_types,
+)
+from .table_name import (
+    name_for_mutual_friend_table,
+    name_for_reindex_job_table,
+    name_for_relation_index,
+)
+
+REINDEX_JOB_PENDING = 'pending'
+REINDEX_JOB_RUNNING = 'running'
+REINDEX_JOB_DONE = 'done'
+REINDEX_JOB_FAILED = 'failed'
+
+logger = logging.getLogger(__name__)
+
+
+def sql_for_relation_connections(relation):
+    if relation == 'friends':
+        return '''
+            SELECT m.right_id as id
+            FROM {db_name}.{mutual_friend_table} m
+            WHERE m.left_id = :user_id
+        '''.format(
+            db_name=DB_NAME,
+            mutual_friend_table=name_for_mutual_friend_table(
+                SOCIAL_FEED_TABLE_PREFIX
+            )
+        )
+
+    return '''
+        SELECT f.right_id as id
+        FROM {db_name}._follow f
+        WHERE f.left_id = :user_id
+    '''.format(db_name=DB_NAME)
+
+
+def enqueue_reindex_job(conn, user_id, relation):
+    enqueue_reindex_job_sql = sa.text('''
+        INSERT INTO {db_name}.{reindex_job_table} (
+            user_id,
+            relation,
+            status,
+            processed_connections,
+            created_at,
+            updated_at
+        )
+        VALUES (
+            :user_id,
+            :relation,
+            :status,
+            0,
+            timezone('UTC', now()),
+            timezone('UTC', now())
+        )
+        ON CONFLICT (user_id, relation) WHERE status = 'pending'
+        DO UPDATE SET updated_at = excluded.updated_at
+        RETURNING id
+    '''.format(
+        db_name=DB_NAME,
+        reindex_job_table=name_for_reindex_job_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    return conn.execute(
+        enqueue_reindex_job_sql,
+        user_id=user_id,
+        relation=relation,
+        status=REINDEX_JOB_PENDING
+    ).scalar()
+
+
+def get_reindex_job(conn, user_id, relation):
+    get_reindex_job_sql = sa.text('''
+        SELECT
+            id,
+            status,
+            total_connections,
+            processed_connections,
+            attempts,
+            last_error,
+            created_at,
+            updated_at
+        FROM {db_name}.{reindex_job_table}
+        WHERE user_id = :user_id
+        AND relation = :relation
+        ORDER BY id DESC
+        LIMIT 1
+    '''.format(
+        db_name=DB_NAME,
+        reindex_job_table=name_for_reindex_job_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    return conn.execute(
+        get_reindex_job_sql,
+        user_id=user_id,
+        relation=relation
+    ).first()
+
+
+def lock_reindex_job(conn):
+    reindex_job_table = name_for_reindex_job_table(SOCIAL_FEED_TABLE_PREFIX)
+    lock_reindex_job_sql = sa.text('''
+        SELECT
+            id,
+            user_id,
+            relation,
+            total_connections,
+            processed_connections,
+            connection_cursor,
+            status,
+            attempts
+        FROM {db_name}.{reindex_job_table} job
+        WHERE status IN ('pending', 'running')
+        AND run_after <= timezone('UTC', now())
+        AND NOT EXISTS (
+            SELECT 1
+            FROM {db_name}.{reindex_job_table} running_job
+            WHERE running_job.user_id = job.user_id
+            AND running_job.relation = job.relation
+            AND running_job.status = 'running'
+            AND running_job.id <> job.id
+        )
+        ORDER BY run_after, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    '''.format(
+        db_name=DB_NAME,
+        reindex_job_table=reindex_job_table
+    ))
+    return conn.execute(lock_reindex_job_sql).first()
+
+
+def reindex_record_type_connections(conn, record_type, user_id, relation,
+                                    connection_ids):
+    table_name = name_for_relation_index(
+        prefix=SOCIAL_FEED_TABLE_PREFIX,
+        relation=relation,
+        record_type=record_type
+    )
+
+    remove_current_index_sql = sa.text('''
+        DELETE FROM {db_name}.{table_name}
+        WHERE left_id = :user_id
+        AND right_id IN :connection_ids
+    '''.format(db_name=DB_NAME, table_name=table_name))
+    conn.execute(
+        remove_current_index_sql,
+        user_id=user_id,
+        connection_ids=tuple(connection_ids)
+    )
+
+    pull_fanout_user_exclusion = ''
+    if relation == 'following':
+        pull_fanout_user_exclusion = sql_for_pull_fanout_user_exclusion(
+            'record_table._owner_id'
+        )
+    new_index_sql = '''
+        SELECT
+            :user_id ::text as left_id,
+            record_table._owner_id as right_id,
+            record_table._id as record_ref,
+            record_table._created_at as record_created_at
+        FROM {db_name}.{record_type} record_table
+        WHERE record_table._owner_id IN :connection_ids
+        {pull_fanout_user_exclusion}
+    '''.format(
+        db_name=DB_NAME,
+        record_type=record_type,
+        pull_fanout_user_exclusion=pull_fanout_user_exclusion
+    )
+    create_index_sql = sa.text(
+        sql_for_backfill_insert(table_name, new_index_sql)
+    )
+    conn.execute(
+        create_index_sql,
+        user_id=user_id,
+        connection_ids=tuple(connection_ids)
+    )
+
+
+def remove_record_type_disconnected_index(conn, record_type, user_id,
+                                          relation):
+    table_name = name_for_relation_index(
+        prefix=SOCIAL_FEED_TABLE_PREFIX,
+        relation=relation,
+        record_type=record_type
+    )
+    remove_disconnected_index_sql = sa.text('''
+        DELETE FROM {db_name}.{table_name}
+        WHERE left_id = :user_id
+        AND right_id NOT IN (
+            SELECT {connection_id}
+            FROM ({connections}) connection
+        )
+    '''.format(
+        db_name=DB_NAME,
+        table_name=table_name,
+        connection_id=sql_for_relation_index_id('connection.id'),
+        connections=sql_for_relation_connections(relation)
+    ))
+    conn.execute(
+        remove_disconnected_index_sql,
+        user_id=user_id
+    )
+
+
+def reindex_job_chunk(conn, job):
+    total_connections = job.total_connections
+    if total_connections is None:
+        count_connections_sql = sa.text('''
+            SELECT count(*)
+            FROM ({connections}) connection
+        '''.format(connections=sql_for_relation_connections(job.relation)))
+        total_connections = conn.execute(
+            count_connections_sql,
+            user_id=job.user_id
+        ).scalar()
+
+    get_connections_chunk_sql = sa.text('''
+        SELECT connection.id
+        FROM ({connections}) connection
+        WHERE connection.id > :connection_cursor
+        ORDER BY connection.id
+        LIMIT :chunk_size
+    '''.format(connections=sql_for_relation_connections(job.relation)))
+    connection_ids = [
+        connection.id for connection in conn.execute(
+            get_connections_chunk_sql,
+            user_id=job.user_id,
+            connection_cursor=job.connection_cursor or '',
+            chunk_size=SOCIAL_FEED_REINDEX_CHUNK_SIZE
+        )
+    ]
+
+    connection_cursor = job.connection_cursor
+    if connection_ids:
+        connection_cursor = connection_ids[-1]
+
+    status = REINDEX_JOB_RUNNING
+    if len(connection_ids) < SOCIAL_FEED_REINDEX_CHUNK_SIZE:
+        status = REINDEX_JOB_DONE
+
+    def reindex_record_type(record_type_conn, record_type):
+        if connection_ids:
+            reindex_record_type_connections(
+                record_type_conn,
+                record_type,
+                job.user_id,
+                job.relation,
+                connection_ids
+            )
+        if status == REINDEX_JOB_DONE:
+            remove_record_type_disconnected_index(
+                record_type_conn,
+                record_type,
+                job.user_id,
+                job.relation
+            )
+
+    run_for_record_types(
+        conn,
+        SOCIAL_FEED_RECORD_TYPES,
+        reindex_record_type
+    )
+    bump_feed_versions(conn, [job.user_id])
+
+    update_reindex_job_sql = sa.text('''
+        UPDATE {db_name}.{reindex_job_table}
+        SET status = :status,
+            total_connections = :total_connections,
+            processed_connections = :processed_connections,
+            connection_cursor = :connection_cursor,
+            attempts = 0,
+            updated_at = timezone('UTC', now())
+        WHERE id = :id
+    '''.format(
+        db_name=DB_NAME,
+        reindex_job_table=name_for_reindex_job_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    conn.execute(
+        update_reindex_job_sql,
+        id=job.id,
+        status=status,
+        total_connections=total_connections,
+        processed_connections=(
+            job.processed_connections + len(connection_ids)
+        ),
+        connection_cursor=connection_cursor
+    )
+
+
+def fail_reindex_job(job, error):
+    attempts = job.attempts + 1
+    status = job.status
+    if attempts >= SOCIAL_FEED_WORK_QUEUE_MAX_ATTEMPTS:
+        status = REINDEX_JOB_FAILED
+
+    fail_reindex_job_sql = sa.text('''
+        UPDATE {db_name}.{reindex_job_table}
+        SET status = :status,
+            attempts = :attempts,
+            last_error = :last_error,
+            run_after = (
+                timezone('UTC', now()) + :backoff * interval '1 second'
+            ),
+            updated_at = timezone('UTC', now())
+        WHERE id = :id
+    '''.format(
+        db_name=DB_NAME,
+        reindex_job_table=name_for_reindex_job_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    with db.conn() as conn:
+        conn.execute(
+            fail_reindex_job_sql,
+            id=job.id,
+            status=status,
+            attempts=attempts,
+            last_error=error,
+            backoff=2 ** attempts
+        )
+
+
+def process_reindex_job_chunk():
+    job = None
+    try:
+        with db.conn() as conn:
+            job = lock_reindex_job(conn)
+            if job is None:
+                return False
+
+            reindex_job_chunk(conn, job)
+    except Exception as e:
+        if job is None:
+            raise
+        logger.exception(
+            'Failed to reindex %s of user %s',
+            job.relation,
+            job.user_id
+        )
+        fail_reindex_job(job, repr(e))
+    return True
+
+
+def serialize_reindex_job(job):
+    if job is None:
+        return None
+
+    return {
+        'id': job.id,
+        'status': job.status,
+        'total_connections': job.total_connections,
+        'processed_connections': job.processed_connections,
+        'attempts': job.attempts,
+        'last_error': job.last_error,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat(),
+    }
+
+
+def register_process_reindex_jobs():
+    @every("@every 10s")
+    def process_reindex_jobs():
+        while process_reindex_job_chunk():
+            pass
+
+
+def register_get_reindex_status():
+    @op('social_feed:get_reindex_status', user_required=True)
+    def get_reindex_status(relation):
+        with db.conn() as conn:
+            my_user_id = skygear.utils.context.current_user_id()
+            job = get_reindex_job(conn, my_user_id, relation)
+            return {
+                'job': serialize_reindex_job(job),
+            }
@@ -5,6 +5,14 @@ from skygear import (
 from skygear.utils import db
 import sqlalchemy as sa
 
+from .backfill import (
+    sql_for_backfill_insert,
+)
+
+from .feed import (
+    sql_for_pull_fanout_user_exclusion,
+)
+
 from .options import (
     DB_NAME,
     SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
@@ -12,15 +20,36 @@ from .options import (
     SOCIAL_FEED_TABLE_PREFIX,
 )
 
+from .page_cache import (
+    bump_feed_versions,
+)
+
+from .parallel import (
+    run_for_record_types,
+)
+
+from .reindex import (
+    enqueue_reindex_job,
+    get_reindex_job,
+    serialize_reindex_job,
+)
+
 from .table_name import (
     name_for_followings_relation_index,
-    name_for_friends_relation_index
+    name_for_friends_relation_index,
+    name_for_mutual_friend_table,
 )
 
 from .user import (
     should_record_be_indexed,
 )
 
+from .work_queue import (
+    enqueue_task,
+    is_work_queue_enabled,
+    task,
+)
+
 DIRECTION_MUTUAL = 'mutual'
 DIRECTION_INWARD = 'inward'
 DIRECTION_OUTWARD = 'outward'
@@ -31,6 +60,117 @@ RELATION_TABLE_MAP = {
 }
 
 
+def create_index_for_friends(conn, my_user_id, maybe_my_friend_ids):
+    maybe_my_friend_ids_tuple = tuple(maybe_my_friend_ids)
+
+    sql = sa.text('''
+        SELECT right_id as id
+        FROM {db_name}.{mutual_friend_table}
+        WHERE left_id = :my_user_id
+        AND right_id IN :maybe_my_friend_ids
+    '''.format(
+        db_name=DB_NAME,
+        mutual_friend_table=name_for_mutual_friend_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    results = conn.execute(
+        sql,
+        my_user_id=my_user_id,
+        maybe_my_friend_ids=maybe_my_friend_ids_tuple
+    )
+    my_friend_ids = [user.id for user in results]
+    if not my_friend_ids:
+        return
+    bump_feed_versions(conn, [my_user_id] + my_friend_ids)
+    my_friend_ids_tuple = tuple(my_friend_ids)
+
+    should_fanout_my_records = should_record_be_indexed(
+        DB_NAME,
+        SOCIAL_FEED_RECORD_TYPES,
+        conn,
+        my_user_id,
+        'friends'
+    )
+
+    def create_record_type_index(record_type_conn, record_type):
+        table_name = name_for_friends_relation_index(
+            prefix=SOCIAL_FEED_TABLE_PREFIX,
+            record_type=record_type
+        )
+
+        new_index_sql = '''
+            SELECT
+                :my_user_id ::text as left_id,
+                record_table._owner_id as right_id,
+                record_table._id as record_ref,
+                record_table._created_at as record_created_at
+            FROM {db_name}.{record_type} record_table
+            JOIN {db_name}.user user_table
+            ON (
+                record_table._owner_id = user_table._id
+                AND COALESCE(
+                        user_table.social_feed_fanout_policy,
+                        '{default_fanout_policy}'::jsonb
+                    ) @> '{req_fanout_policy}'::jsonb
+            )
+            WHERE record_table._owner_id in :my_friend_ids
+        '''.format(
+            db_name=DB_NAME,
+            record_type=record_type,
+            default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
+            req_fanout_policy='{"friends": true}'
+        )
+        create_my_friends_records_index_sql = sa.text(
+            sql_for_backfill_insert(table_name, new_index_sql)
+        )
+        record_type_conn.execute(
+            create_my_friends_records_index_sql,
+            my_user_id=my_user_id,
+            my_friend_ids=my_friend_ids_tuple
+        )
+
+        if should_fanout_my_records:
+            new_index_sql = '''
+                SELECT
+                    u.id as left_id,
+                    :my_user_id ::text as right_id,
+                    record_table._id as record_ref,
+                    record_table._created_at as record_created_at
+                FROM {db_name}.{record_type} record_table,
+                     {db_name}._user u
+                WHERE record_table._owner_id = :my_user_id
+                AND u.id in :my_friend_ids
+            '''.format(
+                db_name=DB_NAME,
+                record_type=record_type
+            )
+            create_friends_to_my_records_index_sql = sa.text(
+                sql_for_backfill_insert(table_name, new_index_sql)
+            )
+            record_type_conn.execute(
+                create_friends_to_my_records_index_sql,
+                my_user_id=my_user_id,
+                my_friend_ids=my_friend_ids_tuple
+            )
+
+    run_for_record_types(
+        conn,
+        SOCIAL_FEED_RECORD_TYPES,
+        create_record_type_index
+    )
+
+
+def register_create_index_for_friends_task():
+    @task('social_feed:create_index_for_friends')
+    def create_index_for_friends_task(conn, payload):
+        create_index_for_friends(
+            conn,
+            payload['user_id'],
+            payload['maybe_my_friend_ids']
+        )
+
+
 def register_create_index_for_friends():
     @op('social_feed:create_index_for_friends', user_required=True)
     def social_feed_create_index_for_friends(maybe_my_friends):
@@ -42,145 +182,78 @@ def register_create_index_for_friends():
             maybe_my_friend_ids = [
                 user['user_id'] for user in maybe_my_friends
             ]
-            maybe_my_friend_ids_tuple = tuple(maybe_my_friend_ids)
-
-            sql = sa.text('''
-                SELECT f1.right_id as id
-                FROM {db_name}._friend f1
-                JOIN {db_name}._friend f2
-                ON f1.right_id = f2.left_id
-                WHERE f1.left_id = :my_user_id
-                AND f2.right_id = :my_user_id
-                AND f1.right_id IN :maybe_my_friend_ids
-            '''.format(db_name=DB_NAME))
-            results = conn.execute(
-                sql,
-                my_user_id=my_user_id,
-                maybe_my_friend_ids=maybe_my_friend_ids_tuple
-            )
-            my_friend_ids = [user.id for user in results]
-            if not my_friend_ids:
+            if is_work_queue_enabled():
+                enqueue_task(conn, 'social_feed:create_index_for_friends', {
+                    'user_id': my_user_id,
+                    'maybe_my_friend_ids': maybe_my_friend_ids,
+                })
                 return
-            my_friend_ids_tuple = tuple(my_friend_ids)
-
-            should_fanout_my_records = should_record_be_indexed(
-                DB_NAME,
-                SOCIAL_FEED_RECORD_TYPES,
-                conn,
-                my_user_id,
-                'friends'
-            )
 
-            for record_type in SOCIAL_FEED_RECORD_TYPES:
-                table_name = name_for_friends_relation_index(
-                    prefix=SOCIAL_FEED_TABLE_PREFIX,
-                    record_type=record_type
-                )
-
-                create_my_friends_records_index_sql = sa.text('''
-                    INSERT INTO {db_name}.{table_name} (
-                        _id,
-                        _database_id,
-                        _owner_id,
-                        _created_at,
-                        _created_by,
-                        _updated_at,
-                        _updated_by,
-                        _access,
-                        left_id,
-                        right_id,
-                        record_ref
-                    )
-                    SELECT
-                        uuid_generate_v4() as _id,
-                        '' as _database_id,
-                        :my_user_id as _owner_id,
-                        current_timestamp as _created_at,
-                        :my_user_id as _created_by,
-                        current_timestamp as _updated_at,
-                        :my_user_id as _updated_by,
-                        '[]'::jsonb as _access,
-                        :my_user_id as left_id,
-                        record_table._owner_id as right_id,
-                        record_table._id as record_ref
-                    FROM {db_name}.{record_type} record_table
-                    JOIN {db_name}.user user_table
-                    ON (
-                        record_table._owner_id = user_table._id
-                        AND COALESCE(
-                                user_table.social_feed_fanout_policy,
-                                '{default_fanout_policy}'::jsonb
-                            ) @> '{req_fanout_policy}'::jsonb
-                    )
-                    WHERE record_table._owner_id in :my_friend_ids
-                    AND NOT EXISTS (
-                        SELECT *
-                        FROM {db_name}.{table_name}
-                        WHERE left_id=:my_user_id
-                        AND right_id IN (record_table._owner_id)
-                        AND record_ref IN (record_table._id)
-                    )
-                '''.format(
-                    db_name=DB_NAME,
-                    table_name=table_name,
-                    record_type=record_type,
-                    default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
-                    req_fanout_policy='{"friends": true}'
-                ))
-                conn.execute(
-                    create_my_friends_records_index_sql,
-                    my_user_id=my_user_id,
-                    my_friend_ids=my_friend_ids_tuple
+            create_index_for_friends(conn, my_user_id, maybe_my_friend_ids)
+
+
+def create_index_for_followees(conn, my_user_id, my_followees_ids):
+    my_followees_ids_tuple = tuple(my_followees_ids)
+    bump_feed_versions(conn, [my_user_id])
+
+    def create_record_type_index(record_type_conn, record_type):
+        table_name = name_for_followings_relation_index(
+            prefix=SOCIAL_FEED_TABLE_PREFIX,
+            record_type=record_type
+        )
+
+        new_index_sql = '''
+            SELECT
+                :my_user_id ::text as left_id,
+                record_table._owner_id as right_id,
+                record_table._id as record_ref,
+                record_table._created_at as record_created_at
+            FROM {db_name}.{record_type} record_table
+            JOIN {db_name}.user user_table
+            ON (
+                record_table._owner_id = user_table._id
+                AND COALESCE(
+                        user_table.social_feed_fanout_policy,
+                        '{default_fanout_policy}'::jsonb
+                    ) @> '{req_fanout_policy}'::jsonb
+            )
+            WHERE record_table._owner_id in :my_followees_ids
+            {pull_fanout_user_exclusion}
+        '''.format(
+            db_name=DB_NAME,
+            record_type=record_type,
+            pull_fanout_user_exclusion=(
+                sql_for_pull_fanout_user_exclusion(
+                    'record_table._owner_id'
                 )
-
-                if should_fanout_my_records:
-                    create_friends_to_my_records_index_sql = sa.text('''
-                        INSERT INTO {db_name}.{table_name} (
-                            _id,
-                            _database_id,
-                            _owner_id,
-                            _created_at,
-                            _created_by,
-                            _updated_at,
-                            _updated_by,
-                            _access,
-                            left_id,
-                            right_id,
-                            record_ref
-                        )
-                        SELECT
-                            uuid_generate_v4() as _id,
-                            '' as _database_id,
-                            u.id as _owner_id,
-                            current_timestamp as _created_at,
-                            u.id as _created_by,
-                            current_timestamp as _updated_at,
-                            u.id as _updated_by,
-                            '[]'::jsonb as _access,
-                            u.id as left_id,
-                            :my_user_id as right_id,
-                            record_table._id as record_ref
-                        FROM {db_name}.{record_type} record_table,
-                             {db_name}._user u
-                        WHERE record_table._owner_id = :my_user_id
-                        AND u.id in :my_friend_ids
-                        AND NOT EXISTS (
-                            SELECT *
-                            FROM {db_name}.{table_name}
-                            WHERE right_id = :my_user_id
-                            AND left_id IN :my_friend_ids
-                            AND record_ref IN (record_table._id)
-                        )
-                    '''.format(
-                        db_name=DB_NAME,
-                        table_name=table_name,
-                        record_type=record_type
-                    ))
-                    conn.execute(
-                        create_friends_to_my_records_index_sql,
-                        my_user_id=my_user_id,
-                        my_friend_ids=my_friend_ids_tuple
-                    )
+            ),
+            default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
+            req_fanout_policy='{"following": true}'
+        )
+        create_my_followees_records_index_sql = sa.text(
+            sql_for_backfill_insert(table_name, new_index_sql)
+        )
+        record_type_conn.execute(
+            create_my_followees_records_index_sql,
+            my_user_id=my_user_id,
+            my_followees_ids=my_followees_ids_tuple
+        )
+
+    run_for_record_types(
+        conn,
+        SOCIAL_FEED_RECORD_TYPES,
+        create_record_type_index
+    )
+
+
+def register_create_index_for_followees_task():
+    @task('social_feed:create_index_for_followees')
+    def create_index_for_followees_task(conn, payload):
+        create_index_for_followees(
+            conn,
+            payload['user_id'],
+            payload['my_followees_ids']
+        )
 
 
 def register_create_index_for_followee():
@@ -192,130 +265,143 @@ def register_create_index_for_followee():
         with db.conn() as conn:
             my_user_id = skygear.utils.context.current_user_id()
             my_followees_ids = [followee['user_id'] for followee in followees]
-            my_followees_ids_tuple = tuple(my_followees_ids)
-
-            for record_type in SOCIAL_FEED_RECORD_TYPES:
-                table_name = name_for_followings_relation_index(
-                    prefix=SOCIAL_FEED_TABLE_PREFIX,
-                    record_type=record_type
-                )
+            if is_work_queue_enabled():
+                enqueue_task(conn, 'social_feed:create_index_for_followees', {
+                    'user_id': my_user_id,
+                    'my_followees_ids': my_followees_ids,
+                })
+                return
 
-                create_my_followees_records_index_sql = sa.text('''
-                    INSERT INTO {db_name}.{table_name} (
-                        _id,
-                        _database_id,
-                        _owner_id,
-                        _created_at,
-                        _created_by,
-                        _updated_at,
-                        _updated_by,
-                        _access,
-                        left_id,
-                        right_id,
-                        record_ref
-                    )
-                    SELECT
-                        uuid_generate_v4() as _id,
-                        '' as _database_id,
-                        :my_user_id as _owner_id,
-                        current_timestamp as _created_at,
-                        :my_user_id as _created_by,
-                        current_timestamp as _updated_at,
-                        :my_user_id as _updated_by,
-                        '[]'::jsonb as _access,
-                        :my_user_id as left_id,
-                        record_table._owner_id as right_id,
-                        record_table._id as record_ref
-                    FROM {db_name}.{record_type} record_table
-                    JOIN {db_name}.user user_table
-                    ON (
-                        record_table._owner_id = user_table._id
-                        AND COALESCE(
-                                user_table.social_feed_fanout_policy,
-                                '{default_fanout_policy}'::jsonb
-                            ) @> '{req_fanout_policy}'::jsonb
-                    )
-                    WHERE record_table._owner_id in :my_followees_ids
-                    AND NOT EXISTS (
-                        SELECT *
-                        FROM {db_name}.{table_name}
-                        WHERE left_id=:my_user_id
-                        AND right_id IN (record_table._owner_id)
-                        AND record_ref IN (record_table._id)
-                    )
-                '''.format(
-                    db_name=DB_NAME,
-                    table_name=table_name,
-                    record_type=record_type,
-                    default_fanout_policy=SOCIAL_FEED_FANOUT_POLICY_JSON_STR,
-                    req_fanout_policy='{"following": true}'
-                ))
-                conn.execute(
-                    create_my_followees_records_index_sql,
-                    my_user_id=my_user_id,
-                    my_followees_ids=my_followees_ids_tuple
-                )
+            create_index_for_followees(conn, my_user_id, my_followees_ids)
+
+
+def remove_index_for_friends(conn, my_user_id, my_friends_ids):
+    my_friends_ids_tuple = tuple(my_friends_ids)
+    bump_feed_versions(conn, [my_user_id] + my_friends_ids)
+
+    def remove_record_type_index(record_type_conn, record_type):
+        table_name = name_for_friends_relation_index(
+            prefix=SOCIAL_FEED_TABLE_PREFIX,
+            record_type=record_type
+        )
+
+        remove_my_friends_records_sql = sa.text('''
+            DELETE from {db_name}.{table_name}
+            WHERE left_id = :my_user_id
+            AND right_id in :my_friends_ids
+        '''.format(db_name=DB_NAME, table_name=table_name))
+        record_type_conn.execute(
+            remove_my_friends_records_sql,
+            my_user_id=my_user_id,
+            my_friends_ids=my_friends_ids_tuple
+        )
+
+        remove_friends_my_records_sql = sa.text('''
+            DELETE from {db_name}.{table_name}
+            WHERE left_id in :my_friends_ids
+            AND right_id = :my_user_id
+        '''.format(db_name=DB_NAME, table_name=table_name))
+        record_type_conn.execute(
+            remove_friends_my_records_sql,
+            my_user_id=my_user_id,
+            my_friends_ids=my_friends_ids_tuple
+        )
+
+    run_for_record_types(
+        conn,
+        SOCIAL_FEED_RECORD_TYPES,
+        remove_record_type_index
+    )
+
+
+def register_remove_index_for_friends_task():
+    @task('social_feed:remove_index_for_friends')
+    def remove_index_for_friends_task(conn, payload):
+        remove_index_for_friends(
+            conn,
+            payload['user_id'],
+            payload['my_friends_ids']
+        )
 
 
 def register_remove_index_for_friends():
     @op('social_feed:remove_index_for_friends', user_required=True)
-    def remove_index_for_friends(friends):
+    def social_feed_remove_index_for_friends(friends):
         if not friends:
             return
 
         with db.conn() as conn:
             my_user_id = skygear.utils.context.current_user_id()
             my_friends_ids = [friend['user_id'] for friend in friends]
-            my_friends_ids_tuple = tuple(my_friends_ids)
+            if is_work_queue_enabled():
+                enqueue_task(conn, 'social_feed:remove_index_for_friends', {
+                    'user_id': my_user_id,
+                    'my_friends_ids': my_friends_ids,
+                })
+                return
 
-            for record_type in SOCIAL_FEED_RECORD_TYPES:
-                table_name = name_for_friends_relation_index(
-                    prefix=SOCIAL_FEED_TABLE_PREFIX,
-                    record_type=record_type
-                )
+            remove_index_for_friends(conn, my_user_id, my_friends_ids)
 
-                remove_my_friends_records_sql = sa.text('''
-                    DELETE from {db_name}.{table_name}
-                    WHERE (
-                        left_id = :my_user_id
-                        AND right_id in :my_friends_ids
-                    )
-                    OR (right_id = :my_user_id AND left_id in :my_friends_ids)
-                '''.format(db_name=DB_NAME, table_name=table_name))
-                conn.execute(
-                    remove_my_friends_records_sql,
-                    my_user_id=my_user_id,
-                    my_friends_ids=my_friends_ids_tuple
-                )
+
+def remove_index_for_followees(conn, my_user_id, my_followees_ids):
+    my_followees_ids_tuple = tuple(my_followees_ids)
+    bump_feed_versions(conn, [my_user_id])
+
+    def remove_record_type_index(record_type_conn, record_type):
+        table_name = name_for_followings_relation_index(
+            prefix=SOCIAL_FEED_TABLE_PREFIX,
+            record_type=record_type
+        )
+
+        remove_my_friends_records_sql = sa.text('''
+            DELETE from {db_name}.{table_name}
+            WHERE left_id = :my_user_id
+            AND right_id in :my_followees_ids
+        '''.format(db_name=DB_NAME, table_name=table_name))
+        record_type_conn.execute(
+            remove_my_friends_records_sql,
+            my_user_id=my_user_id,
+            my_followees_ids=my_followees_ids_tuple
+        )
+
+    run_for_record_types(
+        conn,
+        SOCIAL_FEED_RECORD_TYPES,
+        remove_record_type_index
+    )
+
+
+def register_remove_index_for_followees_task():
+    @task('social_feed:remove_index_for_followees')
+    def remove_index_for_followees_task(conn, payload):
+        remove_index_for_followees(
+            conn,
+            payload['user_id'],
+            payload['my_followees_ids']
+        )
 
 
 def register_remove_index_for_followees():
     @op('social_feed:remove_index_for_followees', user_required=True)
-    def remove_index_for_followees(followees):
+    def social_feed_remove_index_for_followees(followees):
         if len(followees) <= 0:
             return
 
         with db.conn() as conn:
             my_user_id = skygear.utils.context.current_user_id()
             my_followees_ids = [followee['user_id'] for followee in followees]
-            my_followees_ids_tuple = tuple(my_followees_ids)
-
-            for record_type in SOCIAL_FEED_RECORD_TYPES:
-                table_name = name_for_followings_relation_index(
-                    prefix=SOCIAL_FEED_TABLE_PREFIX,
-                    record_type=record_type
+            if is_work_queue_enabled():
+                enqueue_task(
+                    conn,
+                    'social_feed:remove_index_for_followees',
+                    {
+                        'user_id': my_user_id,
+                        'my_followees_ids': my_followees_ids,
+                    }
                 )
+                return
 
-                remove_my_friends_records_sql = sa.text('''
-                    DELETE from {db_name}.{table_name}
-                    WHERE left_id = :my_user_id
-                    AND right_id in :my_followees_ids
-                '''.format(db_name=DB_NAME, table_name=table_name))
-                conn.execute(
-                    remove_my_friends_records_sql,
-                    my_user_id=my_user_id,
-                    my_followees_ids=my_followees_ids_tuple
-                )
+            remove_index_for_followees(conn, my_user_id, my_followees_ids)
 
 
 def register_reindex_for_friends():
@@ -323,73 +409,11 @@ def register_reindex_for_friends():
     def reindex_for_friends():
         with db.conn() as conn:
             my_user_id = skygear.utils.context.current_user_id()
-
-            for record_type in SOCIAL_FEED_RECORD_TYPES:
-                table_name = name_for_friends_relation_index(
-                    prefix=SOCIAL_FEED_TABLE_PREFIX,
-                    record_type=record_type
-                )
-
-                remove_current_index_sql = sa.text('''
-                    DELETE FROM {db_name}.{table_name}
-                    WHERE left_id = :my_user_id
-                '''.format(db_name=DB_NAME, table_name=table_name))
-                conn.execute(
-                    remove_current_index_sql,
-                    my_user_id=my_user_id
-                )
-
-                create_my_friends_records_index_sql = sa.text('''
-                    INSERT INTO {db_name}.{table_name} (
-                        _id,
-                        _database_id,
-                        _owner_id,
-                        _created_at,
-                        _created_by,
-                        _updated_at,
-                        _updated_by,
-                        _access,
-                        left_id,
-                        right_id,
-                        record_ref
-                    )
-                    SELECT
-                        uuid_generate_v4() as _id,
-                        '' as _database_id,
-                        :my_user_id as _owner_id,
-                        current_timestamp as _created_at,
-                        :my_user_id as _created_by,
-                        current_timestamp as _updated_at,
-                        :my_user_id as _updated_by,
-                        '[]'::jsonb as _access,
-                        :my_user_id as left_id,
-                        _owner_id as right_id,
-                        _id as record_ref
-                    FROM {db_name}.{record_type} record_table
-                    WHERE _owner_id in (
-                        SELECT f1.right_id as id
-                        FROM {db_name}._friend f1
-                        JOIN {db_name}._friend f2
-                        ON f1.right_id = f2.left_id
-                        WHERE f1.left_id = :my_user_id
-                        AND f2.right_id = :my_user_id
-                    )
-                    AND NOT EXISTS (
-                        SELECT *
-                        FROM {db_name}.{table_name}
-                        WHERE left_id=:my_user_id
-                        AND right_id IN (record_table._owner_id)
-                        AND record_ref IN (record_table._id)
-                    )
-                '''.format(
-                    db_name=DB_NAME,
-                    table_name=table_name,
-                    record_type=record_type
-                ))
-                conn.execute(
-                    create_my_friends_records_index_sql,
-                    my_user_id=my_user_id,
-                )
+            enqueue_reindex_job(conn, my_user_id, 'friends')
+            job = get_reindex_job(conn, my_user_id, 'friends')
+            return {
+                'job': serialize_reindex_job(job),
+            }
 
 
 def register_reindex_for_followees():
@@ -397,67 +421,8 @@ def register_reindex_for_followees():
     def reindex_for_followees():
         with db.conn() as conn:
             my_user_id = skygear.utils.context.current_user_id()
-
-            for record_type in SOCIAL_FEED_RECORD_TYPES:
-                table_name = name_for_followings_relation_index(
-                    prefix=SOCIAL_FEED_TABLE_PREFIX,
-                    record_type=record_type
-                )
-
-                remove_current_index_sql = sa.text('''
-                    DELETE FROM {db_name}.{table_name}
-                    WHERE left_id = :my_user_id
-                '''.format(db_name=DB_NAME, table_name=table_name))
-                conn.execute(
-                    remove_current_index_sql,
-                    my_user_id=my_user_id
-                )
-
-                create_my_friends_records_index_sql = sa.text('''
-                    INSERT INTO {db_name}.{table_name} (
-                        _id,
-                        _database_id,
-                        _owner_id,
-                        _created_at,
-                        _created_by,
-                        _updated_at,
-                        _updated_by,
-                        _access,
-                        left_id,
-                        right_id,
-                        record_ref
-                    )
-                    SELECT
-                        uuid_generate_v4() as _id,
-                        '' as _database_id,
-                        :my_user_id as _owner_id,
-                        current_timestamp as _created_at,
-                        :my_user_id as _created_by,
-                        current_timestamp as _updated_at,
-                        :my_user_id as _updated_by,
-                        '[]'::jsonb as _access,
-                        :my_user_id as left_id,
-                        _owner_id as right_id,
-                        _id as record_ref
-                    FROM {db_name}.{record_type} record_table
-                    WHERE _owner_id in (
-                        SELECT f.right_id as id
-                        FROM {db_name}._follow f
-                        WHERE f.left_id = :my_user_id
-                    )
-                    AND NOT EXISTS (
-                        SELECT *
-                        FROM {db_name}.{table_name}
-                        WHERE left_id=:my_user_id
-                        AND right_id IN (record_table._owner_id)
-                        AND record_ref IN (record_table._id)
-                    )
-                '''.format(
-                    db_name=DB_NAME,
-                    table_name=table_name,
-                    record_type=record_type
-                ))
-                conn.execute(
-                    create_my_friends_records_index_sql,
-                    my_user_id=my_user_id,
-                )
+            enqueue_reindex_job(conn, my_user_id, 'following')
+            job = get_reindex_job(conn, my_user_id, 'following')
+            return {
+                'job': serialize_reindex_job(job),
+            }
@@ -0,0 +1,265 @@
+from decimal import Decimal
+
+import sqlalchemy as sa
+
+from .cache import (
+    MISSING,
+    LRUCache,
+)
+from .feed import (
+    sql_for_feed,
+)
+from .options import (
+    DB_NAME,
+)
+from .query import (
+    SkygearQueryNotSupported,
+    bind_sql_param,
+    generate_sql_order_by_from_skygear_sort,
+    generate_sql_predicate_from_skygear_predicate,
+)
+
+RECORD_QUERY_ENGINE = 'record_query'
+SQL_QUERY_ENGINE = 'sql'
+
+RECORD_METADATA_COLUMNS = {
+    '_owner_id': '_ownerID',
+    '_created_by': '_created_by',
+    '_updated_by': '_updated_by',
+}
+
+RECORD_TIMESTAMP_COLUMNS = ('_created_at', '_updated_at')
+
+RECORD_TYPE_COLUMNS_CACHE_SIZE = 1000
+RECORD_TYPE_COLUMNS_CACHE_TTL = 60
+
+record_type_columns_cache = LRUCache(
+    'record_type_columns',
+    maxsize=RECORD_TYPE_COLUMNS_CACHE_SIZE,
+    ttl=RECORD_TYPE_COLUMNS_CACHE_TTL
+)
+
+
+def get_record_type_columns(conn, record_type):
+    columns = record_type_columns_cache.get(record_type)
+    if columns is not MISSING:
+        if columns is None:
+            raise SkygearQueryNotSupported(
+                'Unsupported record type: ' + record_type
+            )
+        return columns
+
+    get_columns_sql = sa.text('''
+        SELECT
+            c.column_name as name,
+            c.data_type as data_type,
+            fk.ref_table as ref_table
+        FROM information_schema.columns c
+        LEFT JOIN (
+            SELECT
+                kcu.column_name as column_name,
+                ccu.table_name as ref_table
+            FROM information_schema.table_constraints tc
+            JOIN information_schema.key_column_usage kcu
+            ON (
+                kcu.constraint_name = tc.constraint_name
+                AND kcu.table_schema = tc.table_schema
+            )
+            JOIN information_schema.constraint_column_usage ccu
+            ON (
+                ccu.constraint_name = tc.constraint_name
+                AND ccu.table_schema = tc.table_schema
+            )
+            WHERE tc.constraint_type = 'FOREIGN KEY'
+            AND tc.table_schema = :db_name
+            AND tc.table_name = :record_type
+        ) fk
+        ON fk.column_name = c.column_name
+        WHERE c.table_schema = :db_name
+        AND c.table_name = :record_type
+    ''')
+    results = conn.execute(
+        get_columns_sql,
+        db_name=DB_NAME,
+        record_type=record_type
+    )
+
+    columns = {}
+    for column in results:
+        if column.name.startswith('_'):
+            continue
+        if column.ref_table == '_asset' or column.data_type == 'USER-DEFINED':
+            record_type_columns_cache.set(record_type, None)
+            raise SkygearQueryNotSupported(
+                'Unsupported column: ' + column.name
+            )
+        columns[column.name] = column
+
+    record_type_columns_cache.set(record_type, columns)
+    return columns
+
+
+def serialize_timestamp(value):
+    return value.isoformat() + 'Z'
+
+
+def serialize_record_value(column, value):
+    if value is None:
+        return None
+    if column.ref_table is not None:
+        return {
+            '$type': 'ref',
+            '$id': '{0}/{1}'.format(column.ref_table, value),
+        }
+    if column.data_type.startswith('timestamp'):
+        return {
+            '$type': 'date',
+            '$date': serialize_timestamp(value),
+        }
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def serialize_record_row(record_type, columns, row):
+    record = {
+        '_id': '{0}/{1}'.format(record_type, row['_id']),
+        '_type': 'record',
+        '_access': row['_access'],
+    }
+    for column_name, key in RECORD_METADATA_COLUMNS.items():
+        record[key] = row[column_name]
+    for column_name in RECORD_TIMESTAMP_COLUMNS:
+        record[column_name] = serialize_timestamp(row[column_name])
+    for column_name, column in columns.items():
+        record[column_name] = serialize_record_value(
+            column,
+            row[column_name]
+        )
+    return record
+
+
+def generate_sql_access_control_condition(table_alias):
+    return '''
+        (
+            {table_alias}._access IS NULL
+            OR {table_alias}._owner_id = :my_user_id
+            OR {table_alias}._access @> '[{{"public": true}}]'::jsonb
+            OR {table_alias}._access @> jsonb_build_array(
+                jsonb_build_object('user_id', :my_user_id ::text)
+            )
+            OR EXISTS (
+                SELECT 1
+                FROM {db_name}._user_role user_role
+                WHERE user_role.user_id = :my_user_id
+                AND {table_alias}._access @> jsonb_build_array(
+                    jsonb_build_object('role', user_role.role_id)
+                )
+            )
+        )
+    '''.format(db_name=DB_NAME, table_alias=table_alias)
+
+
+def query_feed_records_by_sql(conn, feed_sources, user_id,
+                              serializedSkygearQuery, after, limit):
+    if serializedSkygearQuery.get('include'):
+        raise SkygearQueryNotSupported('Unsupported include')
+    if serializedSkygearQuery.get('count'):
+        raise SkygearQueryNotSupported('Unsupported count')
+
+    record_type = serializedSkygearQuery['record_type']
+    columns = get_record_type_columns(conn, record_type)
+    params = {
+        'my_user_id': user_id,
+    }
+
+    conditions = [generate_sql_access_control_condition('record_table')]
+    if serializedSkygearQuery.get('predicate'):
+        conditions.append(generate_sql_predicate_from_skygear_predicate(
+            serializedSkygearQuery['predicate'],
+            'record_table',
+            params
+        ))
+
+    paginate_by_cursor = after is not None or limit is not None
+    if paginate_by_cursor:
+        if after is not None:
+            conditions.append('''
+                (feed_table.record_created_at, feed_table.record_ref)
+                < ({after_created_at}, {after_id})
+            '''.format(
+                after_created_at=bind_sql_param(params, after['created_at']),
+                after_id=bind_sql_param(params, after['id'])
+            ))
+        from_sql = '''
+            FROM ({feed}) feed_table
+            JOIN {db_name}.{record_type} record_table
+            ON record_table._id = feed_table.record_ref
+            WHERE TRUE
+        '''
+        order_by = [
+            'feed_table.record_created_at DESC',
+            'feed_table.record_ref DESC',
+        ]
+        pagination_sql = 'LIMIT {0}'.format(bind_sql_param(params, limit))
+    else:
+        from_sql = '''
+            FROM {db_name}.{record_type} record_table
+            WHERE record_table._id IN (
+                SELECT record_ref
+                FROM ({feed}) feed_table
+            )
+        '''
+        order_by = generate_sql_order_by_from_skygear_sort(
+            serializedSkygearQuery.get('sort') or [],
+            'record_table'
+        )
+        pagination_sql = ''
+        if serializedSkygearQuery.get('limit') is not None:
+            pagination_sql += ' LIMIT {0}'.format(
+                bind_sql_param(params, serializedSkygearQuery['limit'])
+            )
+        if serializedSkygearQuery.get('offset'):
+            pagination_sql += ' OFFSET {0}'.format(
+                bind_sql_param(params, serializedSkygearQuery['offset'])
+            )
+
+    query_records_sql = sa.text('''
+        SELECT record_table.*
+        {from_sql}
+        AND {conditions}
+        {order_by}
+        {pagination_sql}
+    '''.format(
+        from_sql=from_sql.format(
+            db_name=DB_NAME,
+            feed=sql_for_feed(feed_sources),
+            record_type=record_type
+        ),
+        conditions='\nAND '.join(conditions),
+        order_by='ORDER BY ' + ', '.join(order_by) if order_by else '',
+        pagination_sql=pagination_sql
+    ))
+    results = conn.execute(query_records_sql, **params)
+    rows = results.fetchall()
+    # Fields added to the record type since the columns were cached show up
+    # in record_table.*, reload the columns so they are not left out.
+    if set(
+        key for key in results.keys() if not key.startswith('_')
+    ) != set(columns):
+        record_type_columns_cache.delete(record_type)
+        columns = get_record_type_columns(conn, record_type)
+
+    result = {
+        'result': [
+            serialize_record_row(record_type, columns, row) for row in rows
+        ],
+    }
+    if paginate_by_cursor:
+        result['cursor'] = None
+        if rows and len(rows) >= limit:
+            result['cursor'] = {
+                'created_at': rows[-1]['_created_at'].isoformat(),
+                'id': rows[-1]['_id'],
+            }
+    return result
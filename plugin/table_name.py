@@ -1,5 +1,24 @@
+import hashlib
+
+from .options import (
+    SOCIAL_FEED_INDEX_STORAGE,
+)
+
+POSTGRES_MAX_IDENTIFIER_LENGTH = 63
+IDENTIFIER_HASH_LENGTH = 8
+
+RECORD_INDEX_STORAGE = 'record'
+COMPACT_INDEX_STORAGE = 'compact'
+
+
+def is_compact_index_storage():
+    return SOCIAL_FEED_INDEX_STORAGE == COMPACT_INDEX_STORAGE
+
+
 def name_for_relation_index(prefix, relation, record_type):
     table_name_format = '{prefix}_{relation}_{record_type}'
+    if is_compact_index_storage():
+        table_name_format = '{prefix}_compact_{relation}_{record_type}'
     return table_name_format.format(
         prefix=prefix,
         relation=relation,
@@ -13,3 +32,64 @@ def name_for_friends_relation_index(prefix, record_type):
 
 def name_for_followings_relation_index(prefix, record_type):
     return name_for_relation_index(prefix, 'following', record_type)
+
+
+def name_for_pull_fanout_user_table(prefix):
+    return '{prefix}_pull_fanout_user'.format(prefix=prefix)
+
+
+def name_for_feed_length_table(prefix):
+    return '{prefix}_feed_length'.format(prefix=prefix)
+
+
+def name_for_reindex_job_table(prefix):
+    return '{prefix}_reindex_job'.format(prefix=prefix)
+
+
+def name_for_work_queue_table(prefix):
+    return '{prefix}_work_queue'.format(prefix=prefix)
+
+
+def name_for_backfill_watermark_table(prefix):
+    return '{prefix}_backfill_watermark'.format(prefix=prefix)
+
+
+def name_for_mutual_friend_table(prefix):
+    return '{prefix}_mutual_friend'.format(prefix=prefix)
+
+
+def name_for_orphan_gc_cursor_table(prefix):
+    return '{prefix}_orphan_gc_cursor'.format(prefix=prefix)
+
+
+def name_for_feed_version_table(prefix):
+    return '{prefix}_feed_version'.format(prefix=prefix)
+
+
+def name_for_suffixed_identifier(name, suffix):
+    identifier = '{name}_{suffix}'.format(name=name, suffix=suffix)
+    if len(identifier) <= POSTGRES_MAX_IDENTIFIER_LENGTH:
+        return identifier
+
+    # A hash of the full name keeps truncated names with different suffixes
+    # or long names sharing a prefix from colliding.
+    name_hash = hashlib.sha1(identifier.encode('utf-8')).hexdigest()[
+        :IDENTIFIER_HASH_LENGTH
+    ]
+    name_length = (
+        POSTGRES_MAX_IDENTIFIER_LENGTH - len(suffix) - IDENTIFIER_HASH_LENGTH
+        - 2
+    )
+    return '{name}_{name_hash}_{suffix}'.format(
+        name=name[:name_length],
+        name_hash=name_hash,
+        suffix=suffix
+    )
+
+
+def name_for_table_partition(table_name, partition_suffix):
+    return name_for_suffixed_identifier(table_name, partition_suffix)
+
+
+def name_for_table_index(table_name, index_suffix):
+    return name_for_suffixed_identifier(table_name, index_suffix)
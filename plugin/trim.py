@@ -0,0 +1,171 @@
+from skygear import (
+    every,
+)
+from skygear.utils import db
+import sqlalchemy as sa
+
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_MAX_FEED_LENGTH,
+    SOCIAL_FEED_RECORD_TYPES,
+    SOCIAL_FEED_TABLE_PREFIX,
+    SOCIAL_FEED_TRIM_BATCH_SIZE,
+)
+from .page_cache import (
+    bump_feed_versions,
+)
+from .table_name import (
+    name_for_feed_length_table,
+    name_for_relation_index,
+)
+
+TRIM_FEEDS_PER_TRANSACTION = 10
+
+
+def is_feed_length_cap_enabled():
+    return SOCIAL_FEED_MAX_FEED_LENGTH > 0
+
+
+def sql_for_feed_length_increment(fanouts):
+    fanout_lengths = [
+        '''
+            SELECT
+                '{table_name}'::text as table_name,
+                left_id,
+                count(*) as length
+            FROM {fanout}
+            GROUP BY left_id
+        '''.format(table_name=table_name, fanout=fanout)
+        for table_name, fanout in fanouts
+    ]
+    return '''
+        INSERT INTO {db_name}.{feed_length_table} AS feed_length (
+            table_name,
+            left_id,
+            length
+        )
+        SELECT table_name, left_id, length
+        FROM ({fanout_lengths}) fanout_length
+        ORDER BY table_name, left_id
+        ON CONFLICT (table_name, left_id) DO UPDATE
+        SET length = feed_length.length + excluded.length
+    '''.format(
+        db_name=DB_NAME,
+        feed_length_table=name_for_feed_length_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        ),
+        fanout_lengths='\nUNION ALL\n'.join(fanout_lengths)
+    )
+
+
+def lock_over_length_feeds(conn, table_names, limit):
+    lock_over_length_feeds_sql = sa.text('''
+        SELECT table_name, left_id
+        FROM {db_name}.{feed_length_table}
+        WHERE length > :max_feed_length
+        AND table_name IN :table_names
+        LIMIT :limit
+        FOR UPDATE SKIP LOCKED
+    '''.format(
+        db_name=DB_NAME,
+        feed_length_table=name_for_feed_length_table(
+            SOCIAL_FEED_TABLE_PREFIX
+        )
+    ))
+    return conn.execute(
+        lock_over_length_feeds_sql,
+        max_feed_length=SOCIAL_FEED_MAX_FEED_LENGTH,
+        table_names=tuple(table_names),
+        limit=limit
+    ).fetchall()
+
+
+def trim_feed(conn, table_name, left_id):
+    trim_feed_sql = sa.text('''
+        DELETE FROM {db_name}.{table_name}
+        WHERE left_id = :left_id
+        AND record_ref IN (
+            SELECT record_ref
+            FROM {db_name}.{table_name}
+            WHERE left_id = :left_id
+            ORDER BY record_created_at DESC, record_ref DESC
+            OFFSET :max_feed_length
+            LIMIT :batch_size
+        )
+    '''.format(db_name=DB_NAME, table_name=table_name))
+    trimmed = conn.execute(
+        trim_feed_sql,
+        left_id=left_id,
+        max_feed_length=SOCIAL_FEED_MAX_FEED_LENGTH,
+        batch_size=SOCIAL_FEED_TRIM_BATCH_SIZE
+    ).rowcount
+
+    feed_length_table = name_for_feed_length_table(SOCIAL_FEED_TABLE_PREFIX)
+    params = {
+        'table_name': table_name,
+        'left_id': left_id,
+    }
+    if trimmed < SOCIAL_FEED_TRIM_BATCH_SIZE:
+        # The feed is within the cap now, resync the approximate length.
+        update_feed_length_sql = sa.text('''
+            UPDATE {db_name}.{feed_length_table}
+            SET length = (
+                SELECT count(*)
+                FROM {db_name}.{table_name}
+                WHERE left_id = :left_id
+            )
+            WHERE table_name = :table_name
+            AND left_id = :left_id
+        '''.format(
+            db_name=DB_NAME,
+            feed_length_table=feed_length_table,
+            table_name=table_name
+        ))
+    else:
+        update_feed_length_sql = sa.text('''
+            UPDATE {db_name}.{feed_length_table}
+            SET length = length - :trimmed
+            WHERE table_name = :table_name
+            AND left_id = :left_id
+        '''.format(
+            db_name=DB_NAME,
+            feed_length_table=feed_length_table
+        ))
+        params['trimmed'] = trimmed
+    conn.execute(update_feed_length_sql, **params)
+    if trimmed:
+        bump_feed_versions(conn, [left_id])
+
+
+def trim_over_length_feeds_batch(table_names):
+    with db.conn() as conn:
+        feeds = lock_over_length_feeds(
+            conn,
+            table_names=table_names,
+            limit=TRIM_FEEDS_PER_TRANSACTION
+        )
+        for feed in feeds:
+            trim_feed(conn, feed.table_name, feed.left_id)
+    return len(feeds)
+
+
+def register_trim_over_length_feeds():
+    @every("@every 1h")
+    def trim_over_length_feeds():
+        if not is_feed_length_cap_enabled():
+            return
+
+        table_names = set(
+            name_for_relation_index(
+                prefix=SOCIAL_FEED_TABLE_PREFIX,
+                relation=relation,
+                record_type=record_type
+            )
+            for record_type in SOCIAL_FEED_RECORD_TYPES
+            for relation in ['friends', 'following']
+        )
+        if not table_names:
+            return
+
+        while trim_over_length_feeds_batch(table_names) > 0:
+            pass
@@ -6,24 +6,73 @@ from skygear import (
 )
 from skygear.utils import db
 
+from .cache import (
+    MISSING,
+    LRUCache,
+)
 from .options import (
     DB_NAME,
     SOCIAL_FEED_FANOUT_POLICY,
+    SOCIAL_FEED_FANOUT_POLICY_CACHE_SIZE,
+    SOCIAL_FEED_FANOUT_POLICY_CACHE_TTL,
+    SOCIAL_FEED_FANOUT_POLICY_NOTIFY_ENABLED,
+    SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD,
+    SOCIAL_FEED_TABLE_PREFIX,
+)
+from .table_name import (
+    name_for_pull_fanout_user_table,
 )
 
+FANOUT_POLICY_CHANGE_CHANNEL = 'skygear_social_feed_fanout_policy_change'
 
-def should_record_be_indexed(db_name, default_fanout_policy,
-                             db, user_id, relation):
-    get_user_fanout_policy_sql = sa.text('''
-        SELECT social_feed_fanout_policy as fanout_policy
-        FROM {db_name}.user
-        WHERE _id=:user_id
-    '''.format(db_name=db_name))
-    user_fanout_policy = db.execute(
-        get_user_fanout_policy_sql,
-        user_id=user_id
-    ).scalar()
+fanout_policy_cache = LRUCache(
+    'fanout_policy',
+    maxsize=SOCIAL_FEED_FANOUT_POLICY_CACHE_SIZE,
+    ttl=SOCIAL_FEED_FANOUT_POLICY_CACHE_TTL
+)
+
+pull_fanout_user_cache = LRUCache(
+    'pull_fanout_user',
+    maxsize=SOCIAL_FEED_FANOUT_POLICY_CACHE_SIZE,
+    ttl=SOCIAL_FEED_FANOUT_POLICY_CACHE_TTL
+)
+
+
+def get_users_fanout_policy(db_name, db, user_ids):
+    fanout_policies = {}
+    uncached_user_ids = []
+    for user_id in set(user_ids):
+        fanout_policy = fanout_policy_cache.get(user_id)
+        if fanout_policy is MISSING:
+            uncached_user_ids.append(user_id)
+        else:
+            fanout_policies[user_id] = fanout_policy
+
+    if uncached_user_ids:
+        get_users_fanout_policy_sql = sa.text('''
+            SELECT _id as id, social_feed_fanout_policy as fanout_policy
+            FROM {db_name}.user
+            WHERE _id IN :user_ids
+        '''.format(db_name=db_name))
+        results = db.execute(
+            get_users_fanout_policy_sql,
+            user_ids=tuple(uncached_user_ids)
+        )
+        for user in results:
+            fanout_policies[user.id] = user.fanout_policy
+        for user_id in uncached_user_ids:
+            fanout_policies.setdefault(user_id, None)
+            fanout_policy_cache.set(user_id, fanout_policies[user_id])
 
+    return fanout_policies
+
+
+def get_user_fanout_policy(db_name, db, user_id):
+    return get_users_fanout_policy(db_name, db, [user_id])[user_id]
+
+
+def is_relation_enabled(user_fanout_policy, default_fanout_policy,
+                        relation):
     if user_fanout_policy is not None:
         if relation in user_fanout_policy:
             return user_fanout_policy[relation]
@@ -35,6 +84,87 @@ def should_record_be_indexed(db_name, default_fanout_policy,
     return False
 
 
+def should_record_be_indexed(db_name, default_fanout_policy,
+                             db, user_id, relation):
+    user_fanout_policy = get_user_fanout_policy(db_name, db, user_id)
+    return is_relation_enabled(
+        user_fanout_policy,
+        default_fanout_policy,
+        relation
+    )
+
+
+def get_pull_fanout_user_ids(db_name, db, user_ids):
+    if not SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD:
+        return set()
+
+    pull_fanout_user_ids = set()
+    uncached_user_ids = []
+    for user_id in set(user_ids):
+        is_pull_fanout_user = pull_fanout_user_cache.get(user_id)
+        if is_pull_fanout_user is MISSING:
+            uncached_user_ids.append(user_id)
+        elif is_pull_fanout_user:
+            pull_fanout_user_ids.add(user_id)
+
+    if not uncached_user_ids:
+        return pull_fanout_user_ids
+
+    pull_fanout_user_table = name_for_pull_fanout_user_table(
+        SOCIAL_FEED_TABLE_PREFIX
+    )
+    get_pull_fanout_users_sql = sa.text('''
+        SELECT u.id as id
+        FROM unnest(:user_ids ::text[]) AS u(id)
+        WHERE EXISTS (
+            SELECT 1
+            FROM {db_name}.{pull_fanout_user_table}
+            WHERE user_id = u.id
+        )
+        OR EXISTS (
+            SELECT 1
+            FROM {db_name}._follow
+            WHERE right_id = u.id
+            OFFSET :follower_threshold
+        )
+    '''.format(
+        db_name=db_name,
+        pull_fanout_user_table=pull_fanout_user_table
+    ))
+    results = db.execute(
+        get_pull_fanout_users_sql,
+        user_ids=uncached_user_ids,
+        follower_threshold=SOCIAL_FEED_PULL_FANOUT_FOLLOWER_THRESHOLD
+    )
+    new_pull_fanout_user_ids = [user.id for user in results]
+
+    if new_pull_fanout_user_ids:
+        add_pull_fanout_users_sql = sa.text('''
+            INSERT INTO {db_name}.{pull_fanout_user_table} (
+                user_id,
+                created_at
+            )
+            SELECT u.id, timezone('UTC', now())
+            FROM unnest(:user_ids ::text[]) AS u(id)
+            ON CONFLICT (user_id) DO NOTHING
+        '''.format(
+            db_name=db_name,
+            pull_fanout_user_table=pull_fanout_user_table
+        ))
+        db.execute(
+            add_pull_fanout_users_sql,
+            user_ids=new_pull_fanout_user_ids
+        )
+
+    for user_id in uncached_user_ids:
+        is_pull_fanout_user = user_id in new_pull_fanout_user_ids
+        pull_fanout_user_cache.set(user_id, is_pull_fanout_user)
+        if is_pull_fanout_user:
+            pull_fanout_user_ids.add(user_id)
+
+    return pull_fanout_user_ids
+
+
 def register_set_enable_fanout_to_relation():
     @op('social_feed:setEnableFanoutToRelation', user_required=True)
     def set_enable_fanout_to_relation(relation, enable):
@@ -45,6 +175,7 @@ def register_set_enable_fanout_to_relation():
                 SELECT social_feed_fanout_policy as fanout_policy
                 FROM {db_name}.user
                 WHERE _id=:user_id
+                FOR UPDATE
             '''.format(db_name=DB_NAME))
             fanout_policy = conn.execute(
                 get_user_fanout_policy_sql,
@@ -64,21 +195,30 @@ def register_set_enable_fanout_to_relation():
                 user_id=my_user_id
             )
 
+            if SOCIAL_FEED_FANOUT_POLICY_NOTIFY_ENABLED:
+                # Delivered to the listeners when the transaction commits.
+                notify_fanout_policy_change_sql = sa.text('''
+                    SELECT pg_notify(:channel, :user_id)
+                ''')
+                conn.execute(
+                    notify_fanout_policy_change_sql,
+                    channel=FANOUT_POLICY_CHANGE_CHANNEL,
+                    user_id=my_user_id
+                )
+
+        fanout_policy_cache.set(my_user_id, fanout_policy)
+
 
 def register_get_user_fanout_policy():
     @op('social_feed:getUserFanoutPolicy', user_required=True)
-    def get_user_fanout_policy():
+    def get_user_fanout_policy_op():
         with db.conn() as conn:
             my_user_id = skygear.utils.context.current_user_id()
-            get_user_fanout_policy_sql = sa.text('''
-                SELECT social_feed_fanout_policy as fanout_policy
-                FROM {db_name}.user
-                WHERE _id=:user_id
-            '''.format(db_name=DB_NAME))
-            fanout_policy = conn.execute(
-                get_user_fanout_policy_sql,
-                user_id=my_user_id
-            ).scalar() or SOCIAL_FEED_FANOUT_POLICY
+            fanout_policy = get_user_fanout_policy(
+                DB_NAME,
+                conn,
+                my_user_id
+            ) or SOCIAL_FEED_FANOUT_POLICY
 
         return {
             'fanout_policy': fanout_policy,
@@ -0,0 +1,211 @@
+import json
+import logging
+import threading
+import time
+
+from skygear import (
+    op,
+)
+from skygear.utils import db
+import sqlalchemy as sa
+
+from .options import (
+    DB_NAME,
+    SOCIAL_FEED_TABLE_PREFIX,
+    SOCIAL_FEED_WORK_QUEUE_ENABLED,
+    SOCIAL_FEED_WORK_QUEUE_MAX_ATTEMPTS,
+    SOCIAL_FEED_WORK_QUEUE_POLL_INTERVAL,
+    SOCIAL_FEED_WORK_QUEUE_WORKERS,
+)
+from .table_name import (
+    name_for_work_queue_table,
+)
+
+logger = logging.getLogger(__name__)
+
+TASK_PENDING = 'pending'
+TASK_DEAD = 'dead'
+
+_task_handlers = {}
+_workers = []
+
+
+def task(name):
+    def task_decorator(handler):
+        _task_handlers[name] = handler
+        return handler
+    return task_decorator
+
+
+def is_work_queue_enabled():
+    return SOCIAL_FEED_WORK_QUEUE_ENABLED
+
+
+def enqueue_task(conn, name, payload):
+    enqueue_task_sql = sa.text('''
+        INSERT INTO {db_name}.{work_queue_table} (
+            name,
+            payload,
+            status,
+            attempts,
+            run_at,
+            created_at
+        )
+        VALUES (
+            :name,
+            :payload ::jsonb,
+            :status,
+            0,
+            timezone('UTC', now()),
+            timezone('UTC', now())
+        )
+    '''.format(
+        db_name=DB_NAME,
+        work_queue_table=name_for_work_queue_table(SOCIAL_FEED_TABLE_PREFIX)
+    ))
+    conn.execute(
+        enqueue_task_sql,
+        name=name,
+        payload=json.dumps(payload),
+        status=TASK_PENDING
+    )
+
+
+def lock_task(conn):
+    lock_task_sql = sa.text('''
+        SELECT id, name, payload, attempts
+        FROM {db_name}.{work_queue_table}
+        WHERE status = :status
+        AND run_at <= timezone('UTC', now())
+        ORDER BY run_at, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    '''.format(
+        db_name=DB_NAME,
+        work_queue_table=name_for_work_queue_table(SOCIAL_FEED_TABLE_PREFIX)
+    ))
+    return conn.execute(lock_task_sql, status=TASK_PENDING).first()
+
+
+def complete_task(conn, task_id):
+    complete_task_sql = sa.text('''
+        DELETE FROM {db_name}.{work_queue_table}
+        WHERE id = :id
+    '''.format(
+        db_name=DB_NAME,
+        work_queue_table=name_for_work_queue_table(SOCIAL_FEED_TABLE_PREFIX)
+    ))
+    conn.execute(complete_task_sql, id=task_id)
+
+
+def fail_task(task_id, attempts, error):
+    status = TASK_PENDING
+    if attempts >= SOCIAL_FEED_WORK_QUEUE_MAX_ATTEMPTS:
+        status = TASK_DEAD
+
+    fail_task_sql = sa.text('''
+        UPDATE {db_name}.{work_queue_table}
+        SET status = :status,
+            attempts = :attempts,
+            last_error = :last_error,
+            run_at = timezone('UTC', now()) + :backoff * interval '1 second'
+        WHERE id = :id
+    '''.format(
+        db_name=DB_NAME,
+        work_queue_table=name_for_work_queue_table(SOCIAL_FEED_TABLE_PREFIX)
+    ))
+    with db.conn() as conn:
+        conn.execute(
+            fail_task_sql,
+            id=task_id,
+            status=status,
+            attempts=attempts,
+            last_error=error,
+            backoff=2 ** attempts
+        )
+
+
+def process_task():
+    locked_task = None
+    try:
+        with db.conn() as conn:
+            locked_task = lock_task(conn)
+            if locked_task is None:
+                return False
+
+            handler = _task_handlers[locked_task.name]
+            handler(conn, locked_task.payload)
+            complete_task(conn, locked_task.id)
+    except Exception as e:
+        if locked_task is None:
+            raise
+        logger.exception('Failed to process task %s', locked_task.name)
+        fail_task(locked_task.id, locked_task.attempts + 1, repr(e))
+    return True
+
+
+def run_worker():
+    while True:
+        try:
+            if process_task():
+                continue
+        except Exception:
+            logger.exception('Failed to poll work queue')
+        time.sleep(SOCIAL_FEED_WORK_QUEUE_POLL_INTERVAL)
+
+
+def start_work_queue_workers():
+    if not is_work_queue_enabled() or _workers:
+        return
+
+    for _ in range(SOCIAL_FEED_WORK_QUEUE_WORKERS):
+        worker = threading.Thread(target=run_worker)
+        worker.daemon = True
+        worker.start()
+        _workers.append(worker)
+
+
+def register_get_work_queue_stats():
+    @op('social_feed:get_work_queue_stats', key_required=True)
+    def get_work_queue_stats():
+        get_work_queue_stats_sql = sa.text('''
+            SELECT status, count(*) as count
+            FROM {db_name}.{work_queue_table}
+            GROUP BY status
+        '''.format(
+            db_name=DB_NAME,
+            work_queue_table=name_for_work_queue_table(
+                SOCIAL_FEED_TABLE_PREFIX
+            )
+        ))
+        with db.conn() as conn:
+            results = conn.execute(get_work_queue_stats_sql)
+            return {
+                row.status: row.count for row in results
+            }
+
+
+def register_retry_dead_tasks():
+    @op('social_feed:retry_dead_tasks', key_required=True)
+    def retry_dead_tasks():
+        retry_dead_tasks_sql = sa.text('''
+            UPDATE {db_name}.{work_queue_table}
+            SET status = :pending_status,
+                attempts = 0,
+                run_at = timezone('UTC', now())
+            WHERE status = :dead_status
+        '''.format(
+            db_name=DB_NAME,
+            work_queue_table=name_for_work_queue_table(
+                SOCIAL_FEED_TABLE_PREFIX
+            )
+        ))
+        with db.conn() as conn:
+            result = conn.execute(
+                retry_dead_tasks_sql,
+                pending_status=TASK_PENDING,
+                dead_status=TASK_DEAD
+            )
+            return {
+                'retried': result.rowcount,
+            }